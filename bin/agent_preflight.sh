@@ -2,6 +2,7 @@
 
 # Runtime preflight gate for Square tooling.
 # Contract: agent_preflight.sh --operation <op> --mode <mode> --runtime <id>
+#       or: agent_preflight.sh --daemon  (one JSON request per stdin line, one JSON reply per stdout line)
 
 set -euo pipefail
 
@@ -12,10 +13,12 @@ OPERATION=""
 MODE="${SQUARE_RUNTIME_MODE:-}"
 RUNTIME_ID="${SQUARE_RUNTIME_ID:-local_cli}"
 QUIET=1
+DAEMON=0
 
 usage() {
   cat <<'USAGE'
 Usage: agent_preflight.sh --operation <op> [--mode <mode>] [--runtime <id>] [--verbose]
+       agent_preflight.sh --daemon [--runtime <id>]
 
 Options:
   --operation <op>   Operation id from runtime/operation_policy.json (required)
@@ -23,6 +26,9 @@ Options:
   --runtime <id>     Runtime profile id from runtime/runtime_profiles.json
   --verbose          Print success output (default quiet)
   --quiet            Suppress success output (default)
+  --daemon           Serve checks over stdin/stdout until EOF:
+                     request {"operation": ..., "mode": ..., "runtime": ...}
+                     reply   {"exit": <code>, "message": ...}
   -h, --help         Show this help
 
 Exit codes:
@@ -55,6 +61,10 @@ while [[ $# -gt 0 ]]; do
       QUIET=1
       shift
       ;;
+    --daemon)
+      DAEMON=1
+      shift
+      ;;
     -h|--help)
       usage
       exit 0
@@ -67,7 +77,7 @@ while [[ $# -gt 0 ]]; do
   esac
 done
 
-if [[ -z "$OPERATION" ]]; then
+if [[ -z "$OPERATION" && "$DAEMON" != "1" ]]; then
   echo "Preflight error: --operation is required" >&2
   usage >&2
   exit 22
@@ -82,98 +92,110 @@ if [[ ! -f "$CAPABILITY_FILE" || ! -f "$PROFILE_FILE" || ! -f "$POLICY_FILE" ]];
   exit 20
 fi
 
-python3 - "$CAPABILITY_FILE" "$PROFILE_FILE" "$POLICY_FILE" "$OPERATION" "$MODE" "$RUNTIME_ID" "$QUIET" <<'PY'
+# Passed with -c rather than as a stdin heredoc so --daemon can read requests from stdin.
+PREFLIGHT_PY=$(cat <<'PY'
 import json
+import os
 import sys
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
-capability_file, profile_file, policy_file, operation, requested_mode, runtime_id, quiet_flag = sys.argv[1:8]
+capability_file, profile_file, policy_file, operation, requested_mode, runtime_id, quiet_flag, daemon_flag = sys.argv[1:9]
 quiet = quiet_flag == "1"
 
-with open(capability_file, "r", encoding="utf-8") as f:
-    capability_matrix = json.load(f)
-with open(profile_file, "r", encoding="utf-8") as f:
-    runtime_profiles = json.load(f)
-with open(policy_file, "r", encoding="utf-8") as f:
-    operation_policy = json.load(f)
-
-modes: Dict[str, Any] = capability_matrix.get("modes", {})
-profiles = {p["id"]: p for p in runtime_profiles.get("profiles", [])}
-ops = {entry["operation"]: entry for entry in operation_policy.get("operations", [])}
-
 mode_rank = {
     "WEB_SAFE": 0,
     "LOCAL_STANDARD": 1,
     "LOCAL_PRIVILEGED": 2,
 }
 
-if runtime_id not in profiles:
-    print(f"Preflight denied: unknown runtime profile '{runtime_id}'", file=sys.stderr)
-    sys.exit(20)
-
-profile = profiles[runtime_id]
-mode = requested_mode or profile.get("default_mode")
-if mode not in mode_rank:
-    print(f"Preflight denied: unknown mode '{mode}'", file=sys.stderr)
-    sys.exit(20)
-
-allowed_modes = set(profile.get("allowed_modes", []))
-if mode not in allowed_modes:
-    print(
-        f"Preflight denied: mode '{mode}' is not allowed for runtime '{runtime_id}'",
-        file=sys.stderr,
-    )
-    sys.exit(22)
-
-if mode not in modes:
-    print(f"Preflight denied: capability matrix missing mode '{mode}'", file=sys.stderr)
-    sys.exit(20)
-
-if operation not in ops:
-    print(f"Preflight denied: unknown operation '{operation}'", file=sys.stderr)
-    sys.exit(22)
-
-policy = ops[operation]
-required_mode = policy.get("required_mode", "WEB_SAFE")
-if required_mode not in mode_rank:
-    print(
-        f"Preflight denied: policy for '{operation}' has invalid required_mode '{required_mode}'",
-        file=sys.stderr,
-    )
-    sys.exit(20)
-
-if mode_rank[mode] < mode_rank[required_mode]:
-    reason = policy.get("deny_reason", "Operation not allowed in current mode")
-    print(
-        (
+_loaded: Dict[str, Tuple[int, Any]] = {}
+
+
+def load(path: str) -> Any:
+    # Re-read only when the file changes, so a long-lived daemon still sees policy edits.
+    mtime = os.stat(path).st_mtime_ns
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = (mtime, json.load(f))
+        _loaded[path] = cached
+    return cached[1]
+
+
+def check(operation: str, requested_mode: str, runtime_id: str) -> Tuple[int, str]:
+    capability_matrix = load(capability_file)
+    runtime_profiles = load(profile_file)
+    operation_policy = load(policy_file)
+
+    modes: Dict[str, Any] = capability_matrix.get("modes", {})
+    profiles = {p["id"]: p for p in runtime_profiles.get("profiles", [])}
+    ops = {entry["operation"]: entry for entry in operation_policy.get("operations", [])}
+
+    if runtime_id not in profiles:
+        return 20, f"Preflight denied: unknown runtime profile '{runtime_id}'"
+
+    profile = profiles[runtime_id]
+    mode = requested_mode or profile.get("default_mode")
+    if mode not in mode_rank:
+        return 20, f"Preflight denied: unknown mode '{mode}'"
+
+    allowed_modes = set(profile.get("allowed_modes", []))
+    if mode not in allowed_modes:
+        return 22, f"Preflight denied: mode '{mode}' is not allowed for runtime '{runtime_id}'"
+
+    if mode not in modes:
+        return 20, f"Preflight denied: capability matrix missing mode '{mode}'"
+
+    if operation not in ops:
+        return 22, f"Preflight denied: unknown operation '{operation}'"
+
+    policy = ops[operation]
+    required_mode = policy.get("required_mode", "WEB_SAFE")
+    if required_mode not in mode_rank:
+        return 20, f"Preflight denied: policy for '{operation}' has invalid required_mode '{required_mode}'"
+
+    if mode_rank[mode] < mode_rank[required_mode]:
+        reason = policy.get("deny_reason", "Operation not allowed in current mode")
+        return 22, (
             f"Preflight denied: operation '{operation}' requires {required_mode}, "
             f"but current mode is {mode}. {reason}"
-        ),
-        file=sys.stderr,
-    )
-    sys.exit(22)
-
-capabilities = modes[mode].get("capabilities", {})
-required_capabilities = policy.get("required_capabilities", [])
-missing = [c for c in required_capabilities if not capabilities.get(c, False)]
-
-if missing:
-    print(
-        (
+        )
+
+    capabilities = modes[mode].get("capabilities", {})
+    required_capabilities = policy.get("required_capabilities", [])
+    missing = [c for c in required_capabilities if not capabilities.get(c, False)]
+
+    if missing:
+        return 21, (
             f"Preflight denied: operation '{operation}' missing capabilities "
             f"for mode {mode}: {', '.join(missing)}"
-        ),
-        file=sys.stderr,
-    )
-    sys.exit(21)
-
-if not quiet:
-    print(
-        (
-            f"Preflight OK: operation={operation} runtime={runtime_id} "
-            f"mode={mode}"
         )
-    )
 
-sys.exit(0)
+    return 0, f"Preflight OK: operation={operation} runtime={runtime_id} mode={mode}"
+
+
+if daemon_flag == "1":
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+            code, message = check(
+                request.get("operation") or "",
+                request.get("mode") or "",
+                request.get("runtime") or runtime_id,
+            )
+        except (ValueError, AttributeError):
+            code, message = 22, "Preflight error: malformed daemon request"
+        sys.stdout.write(json.dumps({"exit": code, "message": message}) + "\n")
+        sys.stdout.flush()
+    sys.exit(0)
+
+code, message = check(operation, requested_mode, runtime_id)
+if code:
+    print(message, file=sys.stderr)
+elif not quiet:
+    print(message)
+sys.exit(code)
 PY
+)
+
+exec python3 -c "$PREFLIGHT_PY" "$CAPABILITY_FILE" "$PROFILE_FILE" "$POLICY_FILE" "$OPERATION" "$MODE" "$RUNTIME_ID" "$QUIET" "$DAEMON"
@@ -14,22 +14,311 @@ import json
 import base64
 import requests
 import hashlib
+import functools
+import mmap
+import mimetypes
+import struct
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Callable, Dict, Any, List, Tuple, Union
 from pathlib import Path
 from PIL import Image
-from datetime import datetime, timezone
-from pymongo import MongoClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta, timezone
+import gridfs
+from pymongo import MongoClient, UpdateOne
+
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _b64encode(data: Union[bytes, memoryview]) -> bytes:
+    """Base64-encode bytes, using the SIMD codec when available"""
+    if pybase64 is not None:
+        return pybase64.b64encode(data)
+    return base64.b64encode(data)
+
+
+def _json_str(value: str) -> bytes:
+    """Serialize a single string as a JSON literal"""
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse a JSON response body straight from bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _b64decode(data: str) -> bytes:
+    """Base64-decode a provider response, using the SIMD codec when available"""
+    if pybase64 is not None:
+        return pybase64.b64decode(data, validate=False)
+    return base64.b64decode(data)
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Long-edge cap for images sent to providers; larger inputs are downscaled
+DEFAULT_MAX_DIMENSION = 2048
+
+
+# IHDR (bit depth, colour type) that decodes to each PIL mode as-is
+_PNG_MODE_HEADERS = {
+    'L': (8, 0),
+    'RGB': (8, 2),
+    'LA': (8, 4),
+    'RGBA': (8, 6),
+}
+
+
+def _png_dimensions(image_data: bytes) -> Tuple[int, int]:
+    """Read (width, height) from the IHDR chunk of PNG bytes"""
+    return struct.unpack('>II', image_data[16:24])
+
+
+def _png_matches_mode(image_data: bytes, mode: str) -> bool:
+    """True if the IHDR bit depth (byte 24) and colour type (byte 25) are exactly `mode`"""
+    return _PNG_MODE_HEADERS.get(mode) == (image_data[24], image_data[25])
+
+
+def _read_as_png(image_path: str, mode: str, max_dimension: int = DEFAULT_MAX_DIMENSION) -> Tuple[memoryview, float]:
+    """
+    Return (png_buffer, scale_factor) for an image.
+    
+    PNG files already in `mode` that fit within max_dimension are passed
+    through without touching PIL; anything else is decoded, downscaled to
+    fit, converted to `mode` and re-encoded. The buffer is a zero-copy view over the file or encoder
+    output.
+    """
+    with open(image_path, 'rb') as f:
+        image_data = f.read()
+    if (
+        image_data[:8] == PNG_SIGNATURE
+        and len(image_data) >= 26
+        and _png_matches_mode(image_data, mode)
+        and max(_png_dimensions(image_data)) <= max_dimension
+    ):
+        return memoryview(image_data), 1.0
+    
+    # Convert HEIC/other formats to PNG; the provider re-encodes the result,
+    # so a low zlib level is enough
+    with Image.open(io.BytesIO(image_data)) as img:
+        scale = 1.0
+        if max(img.size) > max_dimension:
+            scale = max_dimension / max(img.size)
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if img.mode != mode:
+            img = img.convert(mode)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', optimize=False, compress_level=1)
+    return buffer.getbuffer(), scale
+
+
+def _is_provider_failure(exc: BaseException) -> bool:
+    """True for errors that reflect provider health: timeouts, connection errors, HTTP 429/5xx"""
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def _build_session() -> requests.Session:
+    """
+    Create a keep-alive session with pooled connections and safe retries.
+    
+    Provider POSTs are paid and not idempotent, so they are only retried
+    when the request can't have been processed: connection failures and
+    429 rate limits (honouring Retry-After). 5xx responses and read errors
+    are left to the circuit breaker and provider fallback.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=3,
+        other=0,
+        backoff_factor=0.3,
+        status_forcelist=[429],
+        allowed_methods=frozenset(['POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Prepared payloads (PNG plus its base64 copy) kept in memory between calls,
+# bounded by their combined size; larger single payloads are never kept
+PAYLOAD_CACHE_MAX_BYTES = 4 * 1024 * 1024
+PAYLOAD_CACHE_MAX_TOTAL_BYTES = 32 * 1024 * 1024
+
+_payload_cache: 'OrderedDict[tuple, Tuple[memoryview, bytes, float]]' = OrderedDict()
+_payload_cache_bytes = 0
+_payload_cache_lock = threading.Lock()
+
+
+def _file_sha256(image_path: str) -> str:
+    """
+    Calculate SHA256 hash of a file.
+    
+    The file is mapped and hashed in a single C-level update, which releases
+    the GIL for the whole file; files that cannot be mapped are read in
+    chunks instead.
+    """
+    with open(image_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hashlib.sha256().hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                return hashlib.sha256(mm).hexdigest()
+        except (OSError, ValueError):
+            f.seek(0)
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            sha256_hash = hashlib.sha256()
+            for byte_block in iter(lambda: f.read(1 << 20), b""):
+                sha256_hash.update(byte_block)
+            return sha256_hash.hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_file_sha256(image_path: str, mtime_ns: int, size: int) -> str:
+    """SHA256 of a file, keyed by (path, mtime, size) so edits invalidate it"""
+    return _file_sha256(image_path)
+
+
+def _cache_payload(key: tuple, payload: Tuple[memoryview, bytes, float]):
+    """Keep a payload, evicting least recently used ones past PAYLOAD_CACHE_MAX_TOTAL_BYTES"""
+    global _payload_cache_bytes
+    size = len(payload[0]) + len(payload[1])
+    if size > PAYLOAD_CACHE_MAX_BYTES:
+        return
+    with _payload_cache_lock:
+        if key in _payload_cache:
+            return
+        _payload_cache[key] = payload
+        _payload_cache_bytes += size
+        while _payload_cache_bytes > PAYLOAD_CACHE_MAX_TOTAL_BYTES:
+            _, (old_data, old_b64, _) = _payload_cache.popitem(last=False)
+            _payload_cache_bytes -= len(old_data) + len(old_b64)
+
+
+def _load_png_payload(
+    image_path: str,
+    mode: str,
+    max_dimension: int = DEFAULT_MAX_DIMENSION
+) -> Tuple[memoryview, bytes, float]:
+    """
+    Return (png_buffer, base64_bytes, scale_factor) for an image.
+    
+    Payloads up to PAYLOAD_CACHE_MAX_BYTES are shared across providers and
+    retries until the file changes on disk.
+    """
+    st = os.stat(image_path)
+    key = (image_path, st.st_mtime_ns, st.st_size, mode, max_dimension)
+    with _payload_cache_lock:
+        cached = _payload_cache.get(key)
+        if cached is not None:
+            _payload_cache.move_to_end(key)
+            return cached
+    image_data, scale = _read_as_png(image_path, mode, max_dimension)
+    payload = (image_data, _b64encode(image_data), scale)
+    _cache_payload(key, payload)
+    return payload
+
+
+class _MultipartFileUpload:
+    """
+    multipart/form-data body that reads the file from disk as it is sent.
+    
+    requests builds `files=` uploads as one in-memory bytes object; this is
+    passed as `data=` instead, so http.client streams it in blocks. tell()
+    and seek() let urllib3 rewind it for a retry.
+    """
+    
+    def __init__(self, fields: Dict[str, str], file_field: str, file, filename: str, mime_type: str):
+        boundary = os.urandom(16).hex()
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        filename = filename.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        head = ''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        ) + (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'
+        )
+        tail = f'\r\n--{boundary}--\r\n'
+        self._parts = (io.BytesIO(head.encode('utf-8')), file, io.BytesIO(tail.encode('utf-8')))
+        self._sizes = (len(self._parts[0].getbuffer()), os.fstat(file.fileno()).st_size, len(self._parts[2].getbuffer()))
+        self._length = sum(self._sizes)
+        self._pos = 0
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._length}[whence]
+        self._pos = min(max(base + offset, 0), self._length)
+        return self._pos
+    
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length - self._pos
+        chunks = []
+        part_start = 0
+        for part, part_size in zip(self._parts, self._sizes):
+            part_end = part_start + part_size
+            if size > 0 and part_start <= self._pos < part_end:
+                part.seek(self._pos - part_start)
+                chunk = part.read(min(size, part_end - self._pos))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                self._pos += len(chunk)
+                size -= len(chunk)
+            part_start = part_end
+        return b''.join(chunks)
 
 
 class BackgroundRemovalProvider(ABC):
     """Abstract base class for background removal providers"""
     
     @abstractmethod
-    def remove_background(self, image_path: str) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    def remove_background(
+        self,
+        image_path: str,
+        max_dimension: int = DEFAULT_MAX_DIMENSION
+    ) -> Tuple[Optional[bytes], Dict[str, Any]]:
         """
         Remove background from image.
         
+        Images whose long edge exceeds max_dimension are downscaled before
+        upload; the applied factor is reported as metadata['scale_factor'].
+        
         Returns:
             Tuple of (processed_image_bytes, metadata_dict)
             Returns (None, error_dict) on failure
@@ -54,54 +343,39 @@ class GeminiBackgroundRemoval(BackgroundRemovalProvider):
         self.api_key = api_key
         self.endpoint = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
         self.cost_per_image = 0.002  # Estimated cost in USD
+        self.session = _build_session()
+        self.session.headers.update({"Content-Type": "application/json"})
         
-    def remove_background(self, image_path: str) -> Tuple[Optional[bytes], Dict[str, Any]]:
+        # Constant JSON envelope around the base64 image, serialized once
+        prompt = "Remove the background from this product image. Return only the foreground object with a transparent background. Output as PNG with transparency."
+        self._payload_prefix = b''.join((
+            b'{"contents":[{"parts":[{"text":',
+            _json_str(prompt),
+            b'},{"inline_data":{"mime_type":"image/png","data":"',
+        ))
+        self._payload_suffix = b'"}}]}],"generationConfig":{"response_mime_type":"image/png"}}'
+        
+    def remove_background(
+        self,
+        image_path: str,
+        max_dimension: int = DEFAULT_MAX_DIMENSION
+    ) -> Tuple[Optional[bytes], Dict[str, Any]]:
         """Remove background using Gemini Vision API"""
         try:
             # Load and prepare image
-            with Image.open(image_path) as img:
-                # Convert HEIC/other formats to PNG
-                if img.format != 'PNG':
-                    buffer = io.BytesIO()
-                    img.convert('RGBA').save(buffer, format='PNG')
-                    image_data = buffer.getvalue()
-                else:
-                    with open(image_path, 'rb') as f:
-                        image_data = f.read()
+            image_data, image_base64, scale = _load_png_payload(image_path, 'RGBA', max_dimension)
             
-            # Encode image to base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            # Prepare request
-            payload = {
-                "contents": [{
-                    "parts": [
-                        {
-                            "text": "Remove the background from this product image. Return only the foreground object with a transparent background. Output as PNG with transparency."
-                        },
-                        {
-                            "inline_data": {
-                                "mime_type": "image/png",
-                                "data": image_base64
-                            }
-                        }
-                    ]
-                }],
-                "generationConfig": {
-                    "response_mime_type": "image/png"
-                }
-            }
+            # Prepare request: the base64 image is written straight into a
+            # pre-serialized JSON body instead of going through json.dumps
+            body = b''.join((self._payload_prefix, image_base64, self._payload_suffix))
             
             # Make API request
-            headers = {
-                "Content-Type": "application/json"
-            }
             url = f"{self.endpoint}?key={self.api_key}"
             
-            response = requests.post(url, json=payload, headers=headers, timeout=60)
+            response = self.session.post(url, data=body, timeout=60)
             response.raise_for_status()
             
-            result = response.json()
+            result = _json_loads(response.content)
             
             # Extract processed image from response
             if 'candidates' in result and len(result['candidates']) > 0:
@@ -109,7 +383,7 @@ class GeminiBackgroundRemoval(BackgroundRemovalProvider):
                 if 'content' in candidate and 'parts' in candidate['content']:
                     for part in candidate['content']['parts']:
                         if 'inline_data' in part:
-                            processed_data = base64.b64decode(part['inline_data']['data'])
+                            processed_data = _b64decode(part['inline_data']['data'])
                             
                             metadata = {
                                 'provider': self.get_provider_name(),
@@ -117,7 +391,8 @@ class GeminiBackgroundRemoval(BackgroundRemovalProvider):
                                 'cost': self.cost_per_image,
                                 'timestamp': datetime.now(timezone.utc).isoformat(),
                                 'original_size': len(image_data),
-                                'processed_size': len(processed_data)
+                                'processed_size': len(processed_data),
+                                'scale_factor': scale
                             }
                             
                             return processed_data, metadata
@@ -135,6 +410,7 @@ class GeminiBackgroundRemoval(BackgroundRemovalProvider):
                 'provider': self.get_provider_name(),
                 'status': 'error',
                 'error': str(e),
+                'provider_failure': _is_provider_failure(e),
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }
     
@@ -152,22 +428,46 @@ class RemoveBgProvider(BackgroundRemovalProvider):
         self.api_key = api_key
         self.endpoint = "https://api.remove.bg/v1.0/removebg"
         self.cost_per_image = 0.002  # Estimated cost in USD per image
+        self.session = _build_session()
+        self.session.headers.update({'X-Api-Key': self.api_key})
     
-    def remove_background(self, image_path: str) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    def remove_background(
+        self,
+        image_path: str,
+        max_dimension: int = DEFAULT_MAX_DIMENSION
+    ) -> Tuple[Optional[bytes], Dict[str, Any]]:
         """Remove background using Remove.bg API"""
         try:
-            # Load image
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
+            # Remove.bg decodes the upload itself, so an image PIL can't read
+            # (or a format it doesn't know) is still sent as-is
+            try:
+                with Image.open(image_path) as img:
+                    oversized = max(img.size) > max_dimension
+            except (OSError, ValueError, Image.DecompressionBombError):
+                oversized = False
             
-            # Prepare request
-            response = requests.post(
-                self.endpoint,
-                files={'image_file': image_data},
-                data={'size': 'auto'},
-                headers={'X-Api-Key': self.api_key},
-                timeout=60
-            )
+            scale = 1.0
+            if oversized:
+                image_data, scale = _read_as_png(image_path, 'RGBA', max_dimension)
+                response = self.session.post(
+                    self.endpoint,
+                    files={'image_file': (f"{Path(image_path).stem}.png", image_data, 'image/png')},
+                    data={'size': 'auto'},
+                    timeout=60
+                )
+            else:
+                # Stream the file from disk instead of building the multipart body in memory
+                mime_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+                with open(image_path, 'rb') as f:
+                    body = _MultipartFileUpload(
+                        {'size': 'auto'}, 'image_file', f, os.path.basename(image_path), mime_type
+                    )
+                    response = self.session.post(
+                        self.endpoint,
+                        data=body,
+                        headers={'Content-Type': body.content_type},
+                        timeout=60
+                    )
             response.raise_for_status()
             
             # Get processed image
@@ -178,8 +478,9 @@ class RemoveBgProvider(BackgroundRemovalProvider):
                 'status': 'success',
                 'cost': self.cost_per_image,
                 'timestamp': datetime.now(timezone.utc).isoformat(),
-                'original_size': len(image_data),
-                'processed_size': len(processed_data)
+                'original_size': os.path.getsize(image_path),
+                'processed_size': len(processed_data),
+                'scale_factor': scale
             }
             
             return processed_data, metadata
@@ -189,6 +490,7 @@ class RemoveBgProvider(BackgroundRemovalProvider):
                 'provider': self.get_provider_name(),
                 'status': 'error',
                 'error': str(e),
+                'provider_failure': _is_provider_failure(e),
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }
     
@@ -207,38 +509,41 @@ class BananaBackgroundRemoval(BackgroundRemovalProvider):
         self.model_key = model_key or os.getenv('BANANA_MODEL_KEY', '')
         self.endpoint = "https://api.banana.dev/run"
         self.cost_per_image = 0.005  # Estimated cost in USD
+        self.session = _build_session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        
+        # Constant JSON envelope around the base64 image, serialized once
+        self._payload_prefix = b''.join((
+            b'{"apiKey":',
+            _json_str(self.api_key),
+            b',"modelKey":',
+            _json_str(self.model_key),
+            b',"modelInputs":{"image":"',
+        ))
+        self._payload_suffix = b'","task":"background_removal"}}'
         
-    def remove_background(self, image_path: str) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    def remove_background(
+        self,
+        image_path: str,
+        max_dimension: int = DEFAULT_MAX_DIMENSION
+    ) -> Tuple[Optional[bytes], Dict[str, Any]]:
         """Remove background using Banana API"""
         try:
             # Load and prepare image
-            with Image.open(image_path) as img:
-                buffer = io.BytesIO()
-                img.convert('RGB').save(buffer, format='PNG')
-                image_data = buffer.getvalue()
+            image_data, image_base64, scale = _load_png_payload(image_path, 'RGB', max_dimension)
             
-            # Encode image to base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            # Prepare request
-            payload = {
-                "apiKey": self.api_key,
-                "modelKey": self.model_key,
-                "modelInputs": {
-                    "image": image_base64,
-                    "task": "background_removal"
-                }
-            }
+            # Prepare request as a pre-serialized JSON body
+            body = b''.join((self._payload_prefix, image_base64, self._payload_suffix))
             
             # Make API request
-            response = requests.post(self.endpoint, json=payload, timeout=60)
+            response = self.session.post(self.endpoint, data=body, timeout=60)
             response.raise_for_status()
             
-            result = response.json()
+            result = _json_loads(response.content)
             
             # Extract processed image from response
             if 'modelOutputs' in result and 'image' in result['modelOutputs']:
-                processed_data = base64.b64decode(result['modelOutputs']['image'])
+                processed_data = _b64decode(result['modelOutputs']['image'])
                 
                 metadata = {
                     'provider': self.get_provider_name(),
@@ -247,7 +552,8 @@ class BananaBackgroundRemoval(BackgroundRemovalProvider):
                     'timestamp': datetime.now(timezone.utc).isoformat(),
                     'original_size': len(image_data),
                     'processed_size': len(processed_data),
-                    'processing_time': result.get('executionTime', 0)
+                    'processing_time': result.get('executionTime', 0),
+                    'scale_factor': scale
                 }
                 
                 return processed_data, metadata
@@ -264,6 +570,7 @@ class BananaBackgroundRemoval(BackgroundRemovalProvider):
                 'provider': self.get_provider_name(),
                 'status': 'error',
                 'error': str(e),
+                'provider_failure': _is_provider_failure(e),
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }
     
@@ -274,20 +581,162 @@ class BananaBackgroundRemoval(BackgroundRemovalProvider):
         return "banana"
 
 
+def _default_output_path(image_path: str) -> str:
+    """Output path used when the caller doesn't give one: <stem>_no_bg.png beside the input"""
+    input_path = Path(image_path)
+    return str(input_path.parent / f"{input_path.stem}_no_bg.png")
+
+
+def _write_output(output_path: str, data: bytes):
+    """
+    Write processed image bytes to disk.
+    
+    Where posix_fadvise is available the written pages are dropped from
+    the page cache, so large batches don't evict hot data. DONTNEED skips
+    dirty pages, so the data (not metadata) is written back first.
+    """
+    # Same permissions as open(..., 'wb'): 0o666 less the umask
+    fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        if hasattr(os, 'posix_fadvise') and hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _wire_compressors() -> str:
+    """Mongo wire compressors to offer, preferring zstd/snappy when installed"""
+    compressors = []
+    for name, module in (('zstd', 'zstandard'), ('snappy', 'snappy')):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        compressors.append(name)
+    compressors.append('zlib')
+    return ','.join(compressors)
+
+
+# Cache entries expire this long after they were written
+CACHE_TTL_SECONDS = 30 * 86400
+
+# GridFS files outlive their (TTL-expired) cache entries until purged; at most this often
+FILE_PURGE_INTERVAL_SECONDS = 3600
+
+# Fields needed to serve a cache hit
+CACHE_PROJECTION = {"_id": 0, "processed_path": 1, "metadata": 1, "file_id": 1}
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+    
+    Opens after `failure_threshold` consecutive provider failures and rejects
+    calls for `recovery_timeout` seconds. It then goes half-open: a single
+    probe call is let through at a time, and its outcome closes the circuit
+    or opens it for another `recovery_timeout`.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.state = self.CLOSED
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def _recovered(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.recovery_timeout
+    
+    def is_open(self) -> bool:
+        """Whether a call would be rejected right now (does not claim the probe)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN:
+                return not self._recovered()
+            return self._probe_in_flight
+    
+    def allow_request(self) -> bool:
+        """Claim permission for one call; in half-open state only one caller gets it"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if not self._recovered():
+                    return False
+                self.state = self.HALF_OPEN
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.opened_at = None
+            self._probe_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+    
+    def release(self):
+        """End a call that said nothing about provider health (e.g. a bad input file)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
 class BackgroundRemovalService:
     """Main service orchestrating background removal operations"""
     
     def __init__(self, mongo_uri: str = "mongodb://localhost:27017/"):
         self.providers: Dict[str, BackgroundRemovalProvider] = {}
         self.default_provider = None
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Provider calls in progress, keyed by image hash
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
         
-        # Connect to MongoDB for caching
-        self.client = MongoClient(mongo_uri)
+        # Connect to MongoDB for caching; pool sized for batch/concurrent use
+        self.client = MongoClient(
+            mongo_uri,
+            maxPoolSize=50,
+            minPoolSize=10,
+            serverSelectionTimeoutMS=2000,
+            waitQueueTimeoutMS=1000,
+            compressors=_wire_compressors(),
+            retryWrites=True
+        )
+        # Warm the pool so the first cache probe doesn't pay server selection
+        self.client.admin.command('ping')
         self.db = self.client['square_cache']
         self.cache_collection = self.db['bg_removal_cache']
+        # Processed PNG bytes, keyed by image hash, so cache hits survive a
+        # wiped local filesystem
+        self.fs = gridfs.GridFS(self.db, collection='bg_removal_files')
+        self._files_collection = self.db['bg_removal_files.files']
+        self._last_file_purge: Optional[float] = None
         
         # Create indexes
         self.cache_collection.create_index("image_hash", unique=True)
+        self.cache_collection.create_index("cached_at", expireAfterSeconds=CACHE_TTL_SECONDS)
+        # TTL can't expire GridFS files (chunks live in a second collection); see _purge_expired_files
+        self._files_collection.create_index("uploadDate")
         
         # Initialize providers from environment
         self._init_providers()
@@ -320,30 +769,240 @@ class BackgroundRemovalService:
     
     def _calculate_image_hash(self, image_path: str) -> str:
         """Calculate SHA256 hash of image file"""
-        sha256_hash = hashlib.sha256()
-        with open(image_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+        st = os.stat(image_path)
+        return _cached_file_sha256(image_path, st.st_mtime_ns, st.st_size)
+    
+    def _hash_many(self, image_paths: List[str]) -> List[str]:
+        """Hash many images in parallel; hashlib releases the GIL while hashing"""
+        if len(image_paths) < 2:
+            return [self._calculate_image_hash(path) for path in image_paths]
+        max_workers = min(8, os.cpu_count() or 1, len(image_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self._calculate_image_hash, image_paths))
     
     def _check_cache(self, image_hash: str) -> Optional[Dict[str, Any]]:
         """Check if processed image exists in cache"""
-        cached = self.cache_collection.find_one({"image_hash": image_hash})
+        cached = self.cache_collection.find_one(
+            {"image_hash": image_hash},
+            projection=CACHE_PROJECTION
+        )
         return cached
     
-    def _save_to_cache(self, image_hash: str, processed_path: str, metadata: Dict[str, Any]):
-        """Save processed image metadata to cache"""
+    def _check_cache_many(self, image_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Look up many image hashes in one query, keyed by image hash"""
+        if not image_hashes:
+            return {}
+        cursor = self.cache_collection.find(
+            {"image_hash": {"$in": image_hashes}},
+            projection={**CACHE_PROJECTION, "image_hash": 1}
+        )
+        return {doc['image_hash']: doc for doc in cursor}
+    
+    def _restore_from_cache(
+        self,
+        cached: Dict[str, Any],
+        image_path: str,
+        output_path: Optional[str]
+    ) -> Optional[str]:
+        """
+        Return a local path for a cached result, rewriting it from GridFS if the file is gone.
+        
+        Bytes are only restored to the caller's output path (or the default
+        one for image_path), never to the path stored with the entry. None
+        means the result must be reprocessed.
+        """
+        processed_path = cached['processed_path']
+        if os.path.exists(processed_path):
+            return processed_path
+        
+        file_id = cached.get('file_id')
+        if file_id is None:
+            return None
+        restore_path = output_path or _default_output_path(image_path)
+        try:
+            processed_data = self.fs.get(file_id).read()
+            _write_output(restore_path, processed_data)
+        except (gridfs.errors.NoFile, OSError) as e:
+            print(f"⚠️  Could not restore cached result to {restore_path}, reprocessing - {e}")
+            return None
+        return restore_path
+    
+    def _build_cache_entry(
+        self,
+        image_hash: str,
+        processed_path: str,
+        metadata: Dict[str, Any],
+        processed_data: Optional[bytes] = None
+    ) -> Dict[str, Any]:
+        """Build a cache document, storing the processed bytes in GridFS when given"""
         cache_entry = {
             "image_hash": image_hash,
             "processed_path": processed_path,
             "metadata": metadata,
             "cached_at": datetime.now(timezone.utc)
         }
+        if processed_data is not None:
+            # Replace any file left by an earlier (expired) entry: it may hold another
+            # provider's output, and its uploadDate drives _purge_expired_files
+            self.fs.delete(image_hash)
+            try:
+                self.fs.put(processed_data, _id=image_hash, filename=image_hash)
+            except gridfs.errors.FileExists:
+                pass  # a concurrent writer stored this hash's output first
+            cache_entry["file_id"] = image_hash
+        else:
+            # Don't let $set keep pointing at a previous run's bytes
+            cache_entry["file_id"] = None
+        return cache_entry
+    
+    def _purge_expired_files(self):
+        """Delete GridFS files old enough that their cache entry has expired"""
+        now = time.monotonic()
+        if self._last_file_purge is not None and now - self._last_file_purge < FILE_PURGE_INTERVAL_SECONDS:
+            return
+        self._last_file_purge = now
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=CACHE_TTL_SECONDS)
+        for doc in self._files_collection.find({"uploadDate": {"$lt": cutoff}}, {"_id": 1}):
+            # fs.delete removes the chunks too
+            self.fs.delete(doc["_id"])
+    
+    def _save_to_cache(
+        self,
+        image_hash: str,
+        processed_path: str,
+        metadata: Dict[str, Any],
+        processed_data: Optional[bytes] = None
+    ):
+        """Save processed image metadata (and bytes, when given) to cache"""
+        cache_entry = self._build_cache_entry(image_hash, processed_path, metadata, processed_data)
         self.cache_collection.update_one(
             {"image_hash": image_hash},
             {"$set": cache_entry},
             upsert=True
         )
+        self._purge_expired_files()
+    
+    def _save_to_cache_many(self, cache_entries: List[Dict[str, Any]]):
+        """Upsert many cache documents in a single bulk write"""
+        if not cache_entries:
+            return
+        # One upsert per hash; duplicates in the same bulk would race on the unique index
+        by_hash = {entry["image_hash"]: entry for entry in cache_entries}
+        self.cache_collection.bulk_write(
+            [
+                UpdateOne({"image_hash": image_hash}, {"$set": entry}, upsert=True)
+                for image_hash, entry in by_hash.items()
+            ],
+            ordered=False
+        )
+        self._purge_expired_files()
+    
+    def _breaker(self, provider_name: str) -> CircuitBreaker:
+        return self._breakers.setdefault(provider_name, CircuitBreaker())
+    
+    def _fallback_provider(self, unhealthy: str) -> Optional[str]:
+        """Return the cheapest provider, other than `unhealthy`, whose circuit admits a call"""
+        candidates = sorted(
+            (info['cost_estimate'], name)
+            for name, info in self.get_provider_info().items()
+            if name != unhealthy
+        )
+        for _, name in candidates:
+            if self._breaker(name).allow_request():
+                return name
+        return None
+    
+    def _singleflight(self, image_hash: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn once per image hash across concurrent callers.
+        
+        Callers arriving while a call for the same hash is in progress wait
+        for it and share its result.
+        
+        Returns:
+            Tuple of (result, is_leader) where is_leader is True for the
+            caller that actually ran fn
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(image_hash)
+            is_leader = future is None
+            if is_leader:
+                future = self._inflight[image_hash] = Future()
+        
+        if not is_leader:
+            return future.result(), False
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(image_hash, None)
+    
+    def _process_image(
+        self,
+        image_path: str,
+        output_path: Optional[str],
+        provider: Optional[str]
+    ) -> Tuple[Optional[str], Dict[str, Any], Optional[bytes]]:
+        """
+        Run the selected provider and write its output, without touching the cache.
+        
+        Returns:
+            Tuple of (output_path, metadata_dict, processed_image_bytes)
+        """
+        # Select provider
+        provider_name = provider or self.default_provider
+        if not provider_name or provider_name not in self.providers:
+            return None, {
+                'status': 'error',
+                'error': f'No provider available. Requested: {provider_name}, Available: {list(self.providers.keys())}'
+            }, None
+        
+        # Skip providers that keep failing
+        if not self._breaker(provider_name).allow_request():
+            fallback = self._fallback_provider(provider_name)
+            if not fallback:
+                return None, {
+                    'provider': provider_name,
+                    'status': 'error',
+                    'error': f'Provider {provider_name} is failing and no healthy fallback is available'
+                }, None
+            print(f"⚠️  {provider_name} circuit open, falling back to {fallback}")
+            provider_name = fallback
+        
+        selected_provider = self.providers[provider_name]
+        print(f"🎨 Processing with {provider_name} (estimated cost: ${selected_provider.get_cost_estimate():.4f})")
+        
+        # Process image
+        processed_data, metadata = selected_provider.remove_background(image_path)
+        
+        # Only provider/transport errors count against the circuit; local
+        # errors (missing file, undecodable image) just release the call
+        breaker = self._breaker(provider_name)
+        if processed_data is None:
+            if metadata.get('provider_failure'):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            return None, metadata, None
+        breaker.record_success()
+        
+        # Generate output path if not provided
+        if output_path is None:
+            output_path = _default_output_path(image_path)
+        
+        # Save processed image
+        _write_output(output_path, processed_data)
+        
+        print(f"✅ Background removed: {output_path}")
+        
+        return output_path, metadata, processed_data
     
     def remove_background(
         self,
@@ -368,43 +1027,84 @@ class BackgroundRemovalService:
         if use_cache:
             image_hash = self._calculate_image_hash(image_path)
             cached = self._check_cache(image_hash)
-            if cached and os.path.exists(cached['processed_path']):
+            cached_path = self._restore_from_cache(cached, image_path, output_path) if cached else None
+            if cached_path:
                 print(f"✅ Using cached processed image")
-                return cached['processed_path'], {**cached['metadata'], 'from_cache': True}
+                return cached_path, {**cached['metadata'], 'from_cache': True}
         
-        # Select provider
-        provider_name = provider or self.default_provider
-        if not provider_name or provider_name not in self.providers:
-            return None, {
-                'status': 'error',
-                'error': f'No provider available. Requested: {provider_name}, Available: {list(self.providers.keys())}'
-            }
+        if not use_cache:
+            output_path, metadata, _ = self._process_image(image_path, output_path, provider)
+            return output_path, metadata
         
-        selected_provider = self.providers[provider_name]
-        print(f"🎨 Processing with {provider_name} (estimated cost: ${selected_provider.get_cost_estimate():.4f})")
+        # Concurrent requests for the same image share one provider call
+        (output_path, metadata, processed_data), is_leader = self._singleflight(
+            image_hash,
+            lambda: self._process_image(image_path, output_path, provider)
+        )
         
-        # Process image
-        processed_data, metadata = selected_provider.remove_background(image_path)
+        # Cache result
+        if output_path and is_leader:
+            self._save_to_cache(image_hash, output_path, metadata, processed_data)
         
-        if processed_data is None:
-            return None, metadata
+        return output_path, metadata
+    
+    def remove_background_batch(
+        self,
+        image_paths: List[str],
+        provider: Optional[str] = None,
+        use_cache: bool = True,
+        concurrency: int = 10
+    ) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+        """
+        Remove background from many images.
         
-        # Generate output path if not provided
-        if output_path is None:
-            input_path = Path(image_path)
-            output_path = str(input_path.parent / f"{input_path.stem}_no_bg.png")
+        Cache lookups and writes for the whole batch are done in one query
+        each; only cache misses are sent to the provider, with up to
+        `concurrency` requests in flight at once.
         
-        # Save processed image
-        with open(output_path, 'wb') as f:
-            f.write(processed_data)
+        Returns:
+            List of (output_path, metadata_dict) in the same order as image_paths
+        """
+        results: List[Optional[Tuple[Optional[str], Dict[str, Any]]]] = [None] * len(image_paths)
+        pending = list(range(len(image_paths)))
         
-        print(f"✅ Background removed: {output_path}")
+        if use_cache:
+            image_hashes = self._hash_many(image_paths)
+            cached = self._check_cache_many(list(set(image_hashes)))
+            pending = []
+            for index, image_hash in enumerate(image_hashes):
+                entry = cached.get(image_hash)
+                cached_path = self._restore_from_cache(entry, image_paths[index], None) if entry else None
+                if cached_path:
+                    results[index] = (cached_path, {**entry['metadata'], 'from_cache': True})
+                else:
+                    pending.append(index)
+            if len(pending) < len(image_paths):
+                print(f"✅ Using {len(image_paths) - len(pending)} cached processed images")
+        
+        def process(index: int) -> Tuple[Tuple[Optional[str], Dict[str, Any], Optional[bytes]], bool]:
+            if not use_cache:
+                return self._process_image(image_paths[index], None, provider), True
+            return self._singleflight(
+                image_hashes[index],
+                lambda: self._process_image(image_paths[index], None, provider)
+            )
+        
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            processed = list(executor.map(process, pending))
+        
+        cache_entries = []
+        for index, ((output_path, metadata, processed_data), is_leader) in zip(pending, processed):
+            results[index] = (output_path, metadata)
+            if output_path and use_cache and is_leader:
+                cache_entries.append(
+                    self._build_cache_entry(image_hashes[index], output_path, metadata, processed_data)
+                )
         
-        # Cache result
         if use_cache:
-            self._save_to_cache(image_hash, output_path, metadata)
+            self._save_to_cache_many(cache_entries)
         
-        return output_path, metadata
+        return results
     
     def get_available_providers(self) -> list[str]:
         """Return list of available provider names"""
@@ -16,15 +16,120 @@ Features:
 """
 
 import os
+import re
 import sys
 import json
+import logging
 import requests
 import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from collections import Counter
+from typing import Dict, List, Optional, Any, Iterator, Tuple
 from dataclasses import dataclass, asdict
-from pymongo import MongoClient
+from pymongo import MongoClient, DeleteOne, ReplaceOne, UpdateOne
 from pymongo.collection import Collection
+from bson import ObjectId
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields the CLI's search table prints
+SEARCH_TABLE_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "updated_at": 1,
+    "item_data.name": 1,
+    "item_data.variations.item_variation_data.sku": 1
+}
+
+# Sync progress; the CLI prints it to stdout, the MCP server keeps the last lines per sync job
+logger = logging.getLogger("square_cache_manager")
+
+try:
+    import httpx
+    import h2  # noqa: F401 - required by httpx for HTTP/2
+except ImportError:
+    httpx = None
+
+# Retry policy for Square API calls (transient errors and rate limits)
+SQUARE_RETRY_TOTAL = 3
+SQUARE_RETRY_BACKOFF = 0.5
+SQUARE_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Number of item writes sent to MongoDB per bulk_write call
+BULK_WRITE_BATCH_SIZE = 1000
+
+# Default page size for change and search queries
+DEFAULT_PAGE_SIZE = 100
+
+# item_data fields hashed individually so diffs only deep-compare changed subtrees
+_SUBTREE_FIELDS = ('name', 'description', 'image_ids', 'variations', 'categories')
+
+# Top-level fields compared directly when an item's hash changes
+_SCALAR_FIELDS = ('version', 'updated_at')
+
+# Item indexes from earlier releases that no query uses; dropped to save write cost
+_LEGACY_ITEM_INDEXES = ("updated_at_1", "version_1", "item_data.name_1")
+# Superseded by the (item_id, timestamp) compound index, which serves the same item_id lookups
+_LEGACY_CHANGE_INDEXES = ("item_id_1",)
+
+# Case-insensitive collation shared by the search indexes and prefix queries
+SEARCH_COLLATION = {"locale": "en", "strength": 2}
+
+# Characters that mark a search pattern as a regex rather than a plain prefix
+_REGEX_METACHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Server-side cursor batch size when streaming change snapshots
+CHANGE_CURSOR_BATCH_SIZE = 500
+
+# Square pages fetched ahead of the sync loop
+PAGE_PREFETCH_DEPTH = 4
+
+# Fields of a cached item needed for change detection and diffing
+CACHED_ITEM_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "type": 1,
+    "version": 1,
+    "updated_at": 1,
+    "content_hash": 1,
+    "subtree_hashes": 1,
+    "item_data": 1
+}
+
+# Fields that change without the item content changing
+_VOLATILE = frozenset({"updated_at", "version", "content_hash", "subtree_hashes", "cached_at", "_id"})
+
+def _canonical_digest(value: Any) -> bytes:
+    """SHA256 digest of a value serialized as key-sorted JSON"""
+    if orjson is not None:
+        json_bytes = orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    else:
+        # ensure_ascii=False matches orjson's UTF-8 output so hashes agree
+        json_bytes = json.dumps(value, sort_keys=True, separators=(',', ':'),
+                                ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(json_bytes).digest()
+
+def _calculate_hash_static(data: Dict) -> bytes:
+    """Calculate SHA256 digest of item data
+    
+    The raw 32-byte digest is stored as BSON binary, half the size of the hex string.
+    """
+    # Remove volatile fields that shouldn't trigger change detection
+    return _canonical_digest({k: v for k, v in data.items() if k not in _VOLATILE})
+
+def _subtree_hashes(item: Dict) -> Dict[str, bytes]:
+    """Digest each compared item_data field so unchanged subtrees can be skipped"""
+    item_data = item.get('item_data') or {}
+    return {field: _canonical_digest(item_data.get(field)) for field in _SUBTREE_FIELDS}
 
 @dataclass
 class ChangeSnapshot:
@@ -38,6 +143,9 @@ class ChangeSnapshot:
     differences: Optional[Dict] = None
     square_version_before: Optional[int] = None
     square_version_after: Optional[int] = None
+    content_hash_before: Optional[bytes] = None
+    content_hash_after: Optional[bytes] = None
+    snapshot_id: Optional[ObjectId] = None  # MongoDB _id, used as the paging cursor
 
 class SquareCacheManager:
     """Manages Square catalog items in MongoDB cache"""
@@ -51,6 +159,31 @@ class SquareCacheManager:
             "Content-Type": "application/json"
         }
         
+        # Keep-alive client so pagination reuses one TLS connection;
+        # HTTP/2 when httpx[http2] is installed, otherwise a pooled requests session
+        self.http2 = httpx is not None
+        if self.http2:
+            limits = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+            self.session = httpx.Client(
+                http2=True,
+                headers=self.headers,
+                timeout=30.0,
+                limits=limits,
+                transport=httpx.HTTPTransport(http2=True, limits=limits, retries=SQUARE_RETRY_TOTAL)
+            )
+        else:
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            retry = Retry(
+                total=SQUARE_RETRY_TOTAL,
+                backoff_factor=SQUARE_RETRY_BACKOFF,
+                status_forcelist=list(SQUARE_RETRY_STATUSES),
+                allowed_methods=frozenset(['GET', 'POST']),
+                respect_retry_after_header=True
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+            self.session.mount("https://", adapter)
+        
         # Connect to MongoDB
         self.client = MongoClient(mongo_uri)
         self.db = self.client['square_cache']
@@ -58,6 +191,7 @@ class SquareCacheManager:
         # Collections
         self.items_collection = self.db['catalog_items']
         self.changes_collection = self.db['change_snapshots']
+        self.versions_collection = self.db['item_versions']
         self.sync_log_collection = self.db['sync_log']
         
         # Create indexes for performance
@@ -67,188 +201,467 @@ class SquareCacheManager:
         """Create MongoDB indexes for optimal performance"""
         # Items collection indexes
         self.items_collection.create_index("id", unique=True)
-        self.items_collection.create_index("updated_at")
-        self.items_collection.create_index("version")
-        self.items_collection.create_index("item_data.name")
+        # Covers the {id, content_hash} change-detection lookup without fetching documents
+        self.items_collection.create_index([("id", 1), ("content_hash", 1)])
+        self.items_collection.create_index(
+            "item_data.name", collation=SEARCH_COLLATION, name="item_data.name_ci"
+        )
+        self.items_collection.create_index(
+            "item_data.variations.item_variation_data.sku",
+            collation=SEARCH_COLLATION,
+            name="item_data.variations.item_variation_data.sku_ci"
+        )
         
         # Changes collection indexes
-        self.changes_collection.create_index("item_id")
+        # get_item_history: equality on item_id, newest-first, no in-memory sort
+        self.changes_collection.create_index([("item_id", 1), ("timestamp", -1)])
         self.changes_collection.create_index("timestamp")
         self.changes_collection.create_index("change_type")
         
         # Sync log indexes
         self.sync_log_collection.create_index("timestamp")
+        self.sync_log_collection.create_index(
+            "timestamp",
+            partialFilterExpression={"status": "success"},
+            name="timestamp_success"
+        )
+        
+    def drop_legacy_indexes(self):
+        """Drop indexes from earlier releases that nothing queries any more
         
-    def _calculate_hash(self, data: Dict) -> str:
+        A one-off migration run at the start of a sync rather than on every
+        construction, so read-only users never touch the index set.
+        """
+        for collection, legacy in (
+            (self.items_collection, _LEGACY_ITEM_INDEXES),
+            (self.changes_collection, _LEGACY_CHANGE_INDEXES),
+        ):
+            stale = set(legacy) & set(collection.index_information())
+            for index_name in stale:
+                collection.drop_index(index_name)
+                logger.info("🧹 Dropped legacy index %s.%s", collection.name, index_name)
+    
+    def _calculate_hash(self, data: Dict) -> bytes:
         """Calculate SHA256 hash of item data for change detection"""
-        # Remove volatile fields that shouldn't trigger change detection
-        clean_data = data.copy()
-        if 'updated_at' in clean_data:
-            del clean_data['updated_at']
-        if 'version' in clean_data:
-            del clean_data['version']
-            
-        json_str = json.dumps(clean_data, sort_keys=True, separators=(',', ':'))
-        return hashlib.sha256(json_str.encode()).hexdigest()
+        return _calculate_hash_static(data)
     
-    def _fetch_square_items(self) -> List[Dict]:
-        """Fetch all catalog items from Square API"""
-        items = []
+    def _hash_batch(self, batch: List[Dict]) -> List[bytes]:
+        """Hash a batch of items in-process
+        
+        Worker processes would fork a threaded sync (prefetch, pymongo monitors)
+        and pickle each item, which costs about as much as hashing it.
+        """
+        return [_calculate_hash_static(item) for item in batch]
+    
+    def _last_sync_time(self) -> Optional[datetime]:
+        """Start time of the last successful sync, used as the incremental checkpoint"""
+        last = self.sync_log_collection.find_one(
+            {"status": "success"},
+            sort=[("timestamp", -1)]
+        )
+        if not last:
+            # Logs written before sync status was recorded
+            last = self.sync_log_collection.find_one(
+                {"error": {"$exists": False}},
+                sort=[("timestamp", -1)]
+            )
+        if not last:
+            return None
+        return last['timestamp'].replace(tzinfo=timezone.utc)
+    
+    def _square_request(self, method: str, url: str, **kwargs):
+        """Send a Square API request
+        
+        The requests session retries inside urllib3; httpx only retries failed
+        connections, so rate limits and 5xx responses are retried here.
+        """
+        for attempt in range(SQUARE_RETRY_TOTAL + 1):
+            response = self.session.request(method, url, **kwargs)
+            if (not self.http2 or attempt == SQUARE_RETRY_TOTAL
+                    or response.status_code not in SQUARE_RETRY_STATUSES):
+                return response
+            try:
+                delay = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = SQUARE_RETRY_BACKOFF * (2 ** attempt)
+            time.sleep(delay)
+    
+    def _iter_square_pages(self, begin_time: Optional[datetime] = None) -> Iterator[List[Dict]]:
+        """Yield pages of catalog items from Square API
+        
+        Args:
+            begin_time: Only fetch items changed since this time (including deletions).
+                        Fetches the full catalog when None.
+        """
         cursor = None
         
         while True:
-            url = f"{self.square_base_url}/catalog/list?types=ITEM"
-            if cursor:
-                url += f"&cursor={cursor}"
-                
-            response = requests.get(url, headers=self.headers)
+            if begin_time:
+                body = {
+                    "object_types": ["ITEM"],
+                    "begin_time": begin_time.isoformat(),
+                    "include_deleted_objects": True
+                }
+                if cursor:
+                    body["cursor"] = cursor
+                response = self._square_request("POST", f"{self.square_base_url}/catalog/search", json=body)
+            else:
+                url = f"{self.square_base_url}/catalog/list?types=ITEM"
+                if cursor:
+                    url += f"&cursor={cursor}"
+                response = self._square_request("GET", url)
             response.raise_for_status()
             
             data = response.json()
             
-            if 'objects' in data:
-                items.extend(data['objects'])
+            yield data.get('objects', [])
                 
             cursor = data.get('cursor')
             if not cursor:
                 break
-                
-        return items
     
-    def _detect_changes(self, square_item: Dict) -> Optional[ChangeSnapshot]:
-        """Detect changes between Square item and cached version"""
+    def _prefetch_square_pages(self, begin_time: Optional[datetime] = None) -> Iterator[List[Dict]]:
+        """Yield Square pages while a background thread fetches the next ones
+        
+        Network round trips overlap with the caller's hashing and MongoDB writes;
+        at most PAGE_PREFETCH_DEPTH pages are buffered.
+        """
+        pages: queue.Queue = queue.Queue(maxsize=PAGE_PREFETCH_DEPTH)
+        stop = threading.Event()
+        done = object()
+        
+        def produce():
+            try:
+                for page in self._iter_square_pages(begin_time):
+                    while not stop.is_set():
+                        try:
+                            pages.put(page, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            finally:
+                pages.put(done)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            producer = executor.submit(produce)
+            try:
+                while True:
+                    page = pages.get()
+                    if page is done:
+                        break
+                    yield page
+                # Surface fetch errors from the producer thread
+                producer.result()
+            finally:
+                stop.set()
+                # Unblock a producer waiting to hand over its final marker
+                while not producer.done():
+                    try:
+                        pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+    
+    def _fetch_cached_hashes(self, item_ids: List[str]) -> Dict[str, Tuple[bytes, Any]]:
+        """Fetch cached (content hash, Square version) pairs for a batch of IDs in one indexed query"""
+        cursor = self.items_collection.find(
+            {"id": {"$in": item_ids}},
+            {"_id": 0, "id": 1, "content_hash": 1, "version": 1}
+        )
+        hashes = {}
+        for doc in cursor:
+            content_hash = doc.get('content_hash', b'')
+            if isinstance(content_hash, str):
+                # Hex digest from before hashes were stored as binary; rewritten on this sync
+                try:
+                    content_hash = bytes.fromhex(content_hash)
+                except ValueError:
+                    content_hash = b''
+            hashes[doc['id']] = (content_hash, doc.get('version'))
+        return hashes
+    
+    def _fetch_cached_items(self, item_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch full cached items for a batch of IDs in a single query"""
+        cursor = self.items_collection.find(
+            {"id": {"$in": item_ids}},
+            CACHED_ITEM_PROJECTION
+        )
+        return {doc['id']: doc for doc in cursor}
+    
+    def _detect_changes(self, square_item: Dict, square_hash: bytes, cached_hash: Optional[bytes],
+                        cached_item: Optional[Dict] = None,
+                        now: Optional[datetime] = None) -> Optional[Dict]:
+        """Detect changes between Square item and cached version
+        
+        Returns a change snapshot document (ChangeSnapshot fields) ready for
+        insertion, or None if the item is unchanged. Snapshots reference item
+        versions by content hash instead of embedding full before/after data.
+        
+        Args:
+            square_item: Item as returned by Square
+            square_hash: Content hash of square_item
+            cached_hash: Content hash of the cached item, or None if not cached
+            cached_item: Full cached item, only needed when the hashes differ
+            now: Timestamp for the snapshot (defaults to the current time)
+        """
+        now = now or datetime.now(timezone.utc)
         item_id = square_item['id']
-        cached_item = self.items_collection.find_one({"id": item_id})
         
-        if not cached_item:
+        if square_item.get('is_deleted'):
+            if cached_hash is None:
+                return None
+            # Item deleted in Square
+            return {
+                "item_id": item_id,
+                "item_name": cached_item.get('item_data', {}).get('name', 'Unknown'),
+                "change_type": 'delete',
+                "timestamp": now,
+                "differences": None,
+                "square_version_before": cached_item.get('version'),
+                "square_version_after": square_item.get('version'),
+                "content_hash_before": cached_hash,
+                "content_hash_after": None
+            }
+        
+        if cached_hash is None:
             # New item
-            return ChangeSnapshot(
-                item_id=item_id,
-                item_name=square_item.get('item_data', {}).get('name', 'Unknown'),
-                change_type='create',
-                timestamp=datetime.now(timezone.utc),
-                before_data=None,
-                after_data=square_item,
-                square_version_after=square_item.get('version')
-            )
+            return {
+                "item_id": item_id,
+                "item_name": square_item.get('item_data', {}).get('name', 'Unknown'),
+                "change_type": 'create',
+                "timestamp": now,
+                "differences": None,
+                "square_version_before": None,
+                "square_version_after": square_item.get('version'),
+                "content_hash_before": None,
+                "content_hash_after": square_hash
+            }
         
         # Check if item has changed (excluding volatile fields)
-        square_hash = self._calculate_hash(square_item)
-        cached_hash = cached_item.get('content_hash', '')
-        
         if square_hash != cached_hash:
             # Item updated
             differences = self._find_differences(cached_item, square_item)
             
-            return ChangeSnapshot(
-                item_id=item_id,
-                item_name=square_item.get('item_data', {}).get('name', 'Unknown'),
-                change_type='update',
-                timestamp=datetime.now(timezone.utc),
-                before_data=cached_item,
-                after_data=square_item,
-                differences=differences,
-                square_version_before=cached_item.get('version'),
-                square_version_after=square_item.get('version')
-            )
+            return {
+                "item_id": item_id,
+                "item_name": square_item.get('item_data', {}).get('name', 'Unknown'),
+                "change_type": 'update',
+                "timestamp": now,
+                "differences": differences,
+                "square_version_before": cached_item.get('version'),
+                "square_version_after": square_item.get('version'),
+                "content_hash_before": cached_hash,
+                "content_hash_after": square_hash
+            }
             
         return None
     
     def _find_differences(self, before: Dict, after: Dict) -> Dict:
-        """Find specific differences between before and after data"""
+        """Find specific differences between before and after data
+        
+        Subtrees whose stored hashes match are skipped without comparing values.
+        """
         differences = {}
         
-        # Compare key fields
-        compare_fields = [
-            'item_data.name',
-            'item_data.description', 
-            'item_data.image_ids',
-            'item_data.variations',
-            'item_data.categories',
-            'version',
-            'updated_at'
-        ]
-        
-        for field_path in compare_fields:
-            before_val = self._get_nested_value(before, field_path)
-            after_val = self._get_nested_value(after, field_path)
+        before_subtrees = before.get('subtree_hashes') or _subtree_hashes(before)
+        after_subtrees = after.get('subtree_hashes') or _subtree_hashes(after)
+        before_data = before.get('item_data') or {}
+        after_data = after.get('item_data') or {}
+        
+        for field in _SUBTREE_FIELDS:
+            if before_subtrees.get(field) == after_subtrees.get(field):
+                continue
             
-            if before_val != after_val:
-                differences[field_path] = {
-                    'before': before_val,
-                    'after': after_val
+            if field == 'variations':
+                # Compare variations one by one instead of as a whole list
+                self._diff_variations(before_data.get(field), after_data.get(field), differences)
+            else:
+                differences[f'item_data.{field}'] = {
+                    'before': before_data.get(field),
+                    'after': after_data.get(field)
+                }
+        
+        for field in _SCALAR_FIELDS:
+            if before.get(field) != after.get(field):
+                differences[field] = {
+                    'before': before.get(field),
+                    'after': after.get(field)
                 }
                 
         return differences
     
-    def _get_nested_value(self, data: Dict, path: str) -> Any:
-        """Get nested value from dict using dot notation"""
-        keys = path.split('.')
-        value = data
-        
-        for key in keys:
-            if isinstance(value, dict) and key in value:
-                value = value[key]
-            else:
-                return None
-                
-        return value
+    def _diff_variations(self, before: Optional[List[Dict]], after: Optional[List[Dict]],
+                         differences: Dict):
+        """Record added, removed and changed variations
+        
+        Entries are keyed 'item_data.variations.<variation id>' (IDs are stable
+        across SKU edits) and carry the SKU as a display label.
+        """
+        before_vars = self._index_variations(before)
+        after_vars = self._index_variations(after)
+        
+        for key in before_vars.keys() | after_vars.keys():
+            before_var, before_hash = before_vars.get(key, (None, None))
+            after_var, after_hash = after_vars.get(key, (None, None))
+            
+            if before_hash != after_hash:
+                labelled = after_var or before_var
+                differences[f'item_data.variations.{key}'] = {
+                    'sku': (labelled.get('item_variation_data') or {}).get('sku'),
+                    'before': before_var,
+                    'after': after_var
+                }
     
-    def sync_from_square(self) -> Dict[str, Any]:
-        """Sync all items from Square to MongoDB cache"""
-        print("🔄 Starting Square catalog sync...")
+    def _index_variations(self, variations: Optional[List[Dict]]) -> Dict[str, Tuple[Dict, bytes]]:
+        """Map each variation's ID to the variation and its content hash"""
+        indexed = {}
+        for position, variation in enumerate(variations or []):
+            # SKUs are optional and may repeat, so only fall back to position for unsaved variations
+            key = variation.get('id') or f'#{position}'
+            indexed[key] = (variation, self._calculate_hash(variation))
+        return indexed
+    
+    def _sync_batch(self, batch: List[Dict], now: datetime) -> List[Dict]:
+        """Detect changes for a batch of Square items and write them to the cache"""
+        batch_hashes = self._hash_batch(batch)
+        cached = self._fetch_cached_hashes([item['id'] for item in batch])
+        
+        # Items whose cached hash matches have unchanged content: no document
+        # fetch, no snapshot, and at most a $set of the fields the hash leaves out
+        pending = []
+        refreshes = []
+        for item, content_hash in zip(batch, batch_hashes):
+            cached_hash, cached_version = cached.get(item['id'], (None, None))
+            if cached_hash != content_hash:
+                pending.append((item, content_hash))
+            elif item.get('version') != cached_version:
+                refreshes.append(UpdateOne(
+                    {"id": item['id']},
+                    {"$set": {
+                        "version": item.get('version'),
+                        "updated_at": item.get('updated_at'),
+                        "cached_at": now
+                    }}
+                ))
+        if refreshes:
+            self.items_collection.bulk_write(refreshes, ordered=False)
+        if not pending:
+            return []
+        batch = [item for item, _ in pending]
+        batch_hashes = [content_hash for _, content_hash in pending]
+        
+        # Load full documents only for cached items whose content changed
+        cached_hashes = {item_id: content_hash for item_id, (content_hash, _) in cached.items()}
+        changed_ids = [item['id'] for item in batch if item['id'] in cached_hashes]
+        cached_items = self._fetch_cached_items(changed_ids) if changed_ids else {}
+        
+        changes = []
+        writes = []
+        version_writes = []
+        for item, content_hash in zip(batch, batch_hashes):
+            cached_hash = cached_hashes.get(item['id'])
+            if cached_hash != content_hash and not item.get('is_deleted'):
+                # Stored with new content so the next diff can reuse them
+                item['subtree_hashes'] = _subtree_hashes(item)
+            
+            # Detect changes
+            change_snapshot = self._detect_changes(
+                item, content_hash,
+                cached_hash,
+                cached_items.get(item['id']),
+                now
+            )
+            if change_snapshot:
+                changes.append(change_snapshot)
+                # Keep each referenced item version once for audit reconstruction
+                if change_snapshot['change_type'] in ('update', 'delete'):
+                    version_writes.append(self._version_write(cached_items[item['id']]))
+                if change_snapshot['change_type'] in ('create', 'update'):
+                    version_writes.append(self._version_write(item))
+            
+            if item.get('is_deleted'):
+                writes.append(DeleteOne({"id": item['id']}))
+                continue
+            
+            # Update cached item
+            item['content_hash'] = content_hash
+            item['cached_at'] = now
+            
+            writes.append(ReplaceOne({"id": item['id']}, item, upsert=True))
+        
+        self.items_collection.bulk_write(writes, ordered=False)
+        if version_writes:
+            self.versions_collection.bulk_write(version_writes, ordered=False)
+        return changes
+    
+    def _version_write(self, item: Dict) -> UpdateOne:
+        """Upsert an item version keyed by item ID and Square version, stored once"""
+        return UpdateOne(
+            {"_id": f"{item['id']}:{item.get('version')}"},
+            {"$setOnInsert": item},
+            upsert=True
+        )
+    
+    def sync_from_square(self, full: bool = False) -> Dict[str, Any]:
+        """Sync items from Square to MongoDB cache
+        
+        Only items changed since the last successful sync are fetched, unless
+        full is set or no previous sync exists. Pages are fetched in the
+        background while earlier pages are hashed and written.
+        """
+        logger.info("🔄 Starting Square catalog sync...")
         
         sync_start = datetime.now(timezone.utc)
         
         try:
-            # Fetch all items from Square
-            square_items = self._fetch_square_items()
-            print(f"📥 Fetched {len(square_items)} items from Square")
+            self.drop_legacy_indexes()
+            
+            # Fetch changed items (or the full catalog) from Square
+            begin_time = None if full else self._last_sync_time()
+            mode = "incremental" if begin_time else "full"
+            logger.info("📥 Fetching items from Square (%s)", mode)
             
             changes = []
-            updated_count = 0
-            created_count = 0
+            total_items = 0
+            batch = []
+            for page in self._prefetch_square_pages(begin_time):
+                total_items += len(page)
+                batch.extend(page)
+                if len(batch) >= BULK_WRITE_BATCH_SIZE:
+                    changes.extend(self._sync_batch(batch, sync_start))
+                    batch = []
             
-            for item in square_items:
-                # Detect changes
-                change_snapshot = self._detect_changes(item)
-                
-                if change_snapshot:
-                    changes.append(change_snapshot)
-                    
-                    if change_snapshot.change_type == 'create':
-                        created_count += 1
-                    elif change_snapshot.change_type == 'update':
-                        updated_count += 1
-                
-                # Update cached item
-                item['content_hash'] = self._calculate_hash(item)
-                item['cached_at'] = datetime.now(timezone.utc)
-                
-                self.items_collection.replace_one(
-                    {"id": item['id']},
-                    item,
-                    upsert=True
-                )
+            if batch:
+                changes.extend(self._sync_batch(batch, sync_start))
+            
+            created_count = sum(1 for c in changes if c['change_type'] == 'create')
+            updated_count = sum(1 for c in changes if c['change_type'] == 'update')
+            deleted_count = sum(1 for c in changes if c['change_type'] == 'delete')
             
             # Save change snapshots
             if changes:
-                change_docs = [asdict(change) for change in changes]
-                self.changes_collection.insert_many(change_docs)
+                self.changes_collection.insert_many(changes, ordered=False)
             
             # Log sync operation
             sync_result = {
                 "timestamp": sync_start,
-                "total_items": len(square_items),
+                "status": "success",
+                "mode": mode,
+                "total_items": total_items,
                 "created_count": created_count,
                 "updated_count": updated_count,
+                "deleted_count": deleted_count,
                 "changes_detected": len(changes),
                 "duration_seconds": (datetime.now(timezone.utc) - sync_start).total_seconds()
             }
             
             self.sync_log_collection.insert_one(sync_result)
             
-            print(f"✅ Sync complete: {created_count} created, {updated_count} updated, {len(changes)} changes detected")
+            logger.info(
+                "✅ Sync complete: %d items, %d created, %d updated, %d deleted, %d changes detected",
+                total_items, created_count, updated_count, deleted_count, len(changes)
+            )
             
             return sync_result
             
@@ -261,50 +674,84 @@ class SquareCacheManager:
             self.sync_log_collection.insert_one(error_result)
             raise
     
-    def get_changed_items(self, since: Optional[datetime] = None) -> List[ChangeSnapshot]:
-        """Get items that have changed since specified time"""
+    def get_changed_items(self, since: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE,
+                          after: Optional[ObjectId] = None) -> Iterator[ChangeSnapshot]:
+        """Stream a page of items that have changed since specified time, newest first
+        
+        Args:
+            since: Only include changes at or after this time
+            limit: Maximum number of changes to return (0 for no limit)
+            after: snapshot_id of the last change on the previous page
+        """
         query = {}
         if since:
             query["timestamp"] = {"$gte": since}
+        if after:
+            query["_id"] = {"$lt": after}
             
-        change_docs = self.changes_collection.find(query).sort("timestamp", -1)
+        # Snapshots are inserted in detection order, so _id order is time order
+        # without the ties a timestamp sort has within one sync
+        change_docs = self.changes_collection.find(
+            query, batch_size=CHANGE_CURSOR_BATCH_SIZE
+        ).sort("_id", -1).limit(limit)
         
-        changes = []
         for doc in change_docs:
-            # Remove MongoDB's _id field and convert back to ChangeSnapshot
-            if '_id' in doc:
-                del doc['_id']
-            doc['timestamp'] = doc['timestamp'].replace(tzinfo=timezone.utc)
-            changes.append(ChangeSnapshot(**doc))
-            
-        return changes
+            yield self._to_snapshot(doc)
     
-    def get_item_history(self, item_id: str) -> List[ChangeSnapshot]:
-        """Get change history for a specific item"""
+    def get_item_history(self, item_id: str) -> Iterator[ChangeSnapshot]:
+        """Stream change history for a specific item, newest first"""
         change_docs = self.changes_collection.find(
-            {"item_id": item_id}
+            {"item_id": item_id}, batch_size=CHANGE_CURSOR_BATCH_SIZE
         ).sort("timestamp", -1)
         
-        history = []
         for doc in change_docs:
-            # Remove MongoDB's _id field and convert back to ChangeSnapshot
-            if '_id' in doc:
-                del doc['_id']
-            doc['timestamp'] = doc['timestamp'].replace(tzinfo=timezone.utc)
-            history.append(ChangeSnapshot(**doc))
-            
-        return history
+            yield self._to_snapshot(doc)
+    
+    def _to_snapshot(self, doc: Dict) -> ChangeSnapshot:
+        """Convert a change document back to ChangeSnapshot, keeping MongoDB's _id as the cursor"""
+        doc['snapshot_id'] = doc.pop('_id')
+        doc['timestamp'] = doc['timestamp'].replace(tzinfo=timezone.utc)
+        return ChangeSnapshot(**doc)
+    
+    def get_item_version(self, item_id: str, version: int) -> Optional[Dict]:
+        """Get a stored version of an item referenced by a change snapshot"""
+        return self.versions_collection.find_one({"_id": f"{item_id}:{version}"})
+    
+    def get_cached_item(self, item_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get cached item by ID (served by the unique id index)"""
+        return self.items_collection.find_one({"id": item_id}, projection)
     
-    def get_cached_item(self, item_id: str) -> Optional[Dict]:
-        """Get cached item by ID"""
-        return self.items_collection.find_one({"id": item_id})
+    def _search_condition(self, pattern: str) -> Dict:
+        """Build a field condition for a search pattern
+        
+        Plain strings (and "^literal" or "^literal.*" anchors) become a
+        case-insensitive prefix range, which the collation indexes can serve;
+        anything else with regex metacharacters is matched as a
+        case-insensitive regex (full scan).
+        """
+        if pattern.startswith("^"):
+            literal = pattern[1:]
+            if literal.endswith(".*") and not literal.endswith("\\.*"):
+                literal = literal[:-2]
+            if _REGEX_METACHARACTERS.search(literal):
+                return {"$regex": pattern, "$options": "i"}
+            pattern = literal
+        elif _REGEX_METACHARACTERS.search(pattern):
+            return {"$regex": pattern, "$options": "i"}
+        # U+FFFF sorts after every character under the ICU collation
+        return {"$gte": pattern, "$lt": pattern + "\uffff"}
     
-    def search_cached_items(self, name_pattern: str = None, sku_pattern: str = None, **filters) -> List[Dict]:
-        """Search cached items with filters
+    def search_cached_items(self, name_pattern: str = None, sku_pattern: str = None,
+                            limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                            projection: Optional[Dict] = None, **filters) -> Iterator[Dict]:
+        """Search cached items with filters, ordered by item ID
         
         Args:
-            name_pattern: Search by item name (regex)
-            sku_pattern: Search by variation SKU (regex)
+            name_pattern: Search by item name (prefix, or regex if it contains metacharacters)
+            sku_pattern: Search by variation SKU (prefix, or regex if it contains metacharacters)
+            limit: Maximum number of items to return (0 for no limit)
+            after: Item ID of the last result on the previous page
+            projection: Fields to return (default: the whole document)
             **filters: Additional MongoDB query filters
         """
         query = {}
@@ -312,36 +759,37 @@ class SquareCacheManager:
         if name_pattern and sku_pattern:
             # Search both name and SKU
             query["$or"] = [
-                {"item_data.name": {"$regex": name_pattern, "$options": "i"}},
-                {"item_data.variations.item_variation_data.sku": {"$regex": sku_pattern, "$options": "i"}}
+                {"item_data.name": self._search_condition(name_pattern)},
+                {"item_data.variations.item_variation_data.sku": self._search_condition(sku_pattern)}
             ]
         elif name_pattern:
-            query["item_data.name"] = {"$regex": name_pattern, "$options": "i"}
+            query["item_data.name"] = self._search_condition(name_pattern)
         elif sku_pattern:
-            query["item_data.variations.item_variation_data.sku"] = {"$regex": sku_pattern, "$options": "i"}
+            query["item_data.variations.item_variation_data.sku"] = self._search_condition(sku_pattern)
+            
+        if after:
+            query["id"] = {"$gt": after}
             
         for key, value in filters.items():
             query[key] = value
             
-        return list(self.items_collection.find(query))
+        yield from self.items_collection.find(
+            query, projection, collation=SEARCH_COLLATION
+        ).sort("id", 1).limit(limit)
     
     def generate_change_report(self, since: Optional[datetime] = None) -> Dict:
         """Generate a detailed change report"""
-        changes = self.get_changed_items(since)
-        
         report = {
             "report_generated": datetime.now(timezone.utc),
             "since": since,
-            "total_changes": len(changes),
-            "summary": {
-                "created": len([c for c in changes if c.change_type == 'create']),
-                "updated": len([c for c in changes if c.change_type == 'update']),
-                "deleted": len([c for c in changes if c.change_type == 'delete'])
-            },
+            "total_changes": 0,
+            "summary": {},
             "changes": []
         }
+        change_counts = Counter()
         
-        for change in changes:
+        for change in self.get_changed_items(since, limit=0):
+            change_counts[change.change_type] += 1
             change_info = {
                 "item_id": change.item_id,
                 "item_name": change.item_name,
@@ -354,10 +802,34 @@ class SquareCacheManager:
                 change_info["key_changes"] = list(change.differences.keys())
                 
             report["changes"].append(change_info)
-            
+        
+        report["total_changes"] = sum(change_counts.values())
+        report["summary"] = {
+            "created": change_counts['create'],
+            "updated": change_counts['update'],
+            "deleted": change_counts['delete']
+        }
         return report
 
 
+def _json_default(value: Any) -> str:
+    """Render non-JSON values (datetimes, ObjectIds, binary hashes) for CLI output"""
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _print_json(data: Any):
+    """Print data as indented JSON, encoding with orjson when available"""
+    if orjson is None:
+        print(json.dumps(data, indent=2, default=_json_default))
+        return
+    sys.stdout.flush()
+    sys.stdout.buffer.write(orjson.dumps(data, option=orjson.OPT_INDENT_2, default=_json_default))
+    sys.stdout.buffer.write(b"\n")
+    sys.stdout.buffer.flush()
+
+
 def main():
     """CLI interface for the cache manager"""
     import argparse
@@ -370,28 +842,33 @@ def main():
     parser.add_argument("--name", help="Name pattern for search command")
     parser.add_argument("--sku", help="SKU pattern for search command")
     parser.add_argument("--since", help="Show changes since (YYYY-MM-DD)")
+    parser.add_argument("--full", action="store_true",
+                       help="Refetch the full catalog instead of an incremental sync")
+    parser.add_argument("--limit", type=int, default=DEFAULT_PAGE_SIZE,
+                       help="Maximum number of results for changes/search (0 for no limit)")
     parser.add_argument("--output", choices=["json", "table"], default="table",
                        help="Output format")
     
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
     
     # Initialize cache manager
     cache_manager = SquareCacheManager(args.token)
     
     try:
         if args.command == "sync":
-            result = cache_manager.sync_from_square()
-            print(json.dumps(result, indent=2, default=str))
+            result = cache_manager.sync_from_square(full=args.full)
+            _print_json(result)
             
         elif args.command == "changes":
             since = None
             if args.since:
                 since = datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc)
                 
-            changes = cache_manager.get_changed_items(since)
+            changes = list(cache_manager.get_changed_items(since, limit=args.limit))
             
             if args.output == "json":
-                print(json.dumps([asdict(c) for c in changes], indent=2, default=str))
+                _print_json([asdict(c) for c in changes])
             else:
                 print(f"\n📋 Found {len(changes)} changes:")
                 print("=" * 80)
@@ -411,7 +888,7 @@ def main():
             report = cache_manager.generate_change_report(since)
             
             if args.output == "json":
-                print(json.dumps(report, indent=2, default=str))
+                _print_json(report)
             else:
                 print(f"\n📊 Change Report")
                 print(f"Generated: {report['report_generated']}")
@@ -435,15 +912,19 @@ def main():
                 
             item = cache_manager.get_cached_item(args.item_id)
             if item:
-                print(json.dumps(item, indent=2, default=str))
+                _print_json(item)
             else:
                 print(f"Item {args.item_id} not found in cache")
                 
         elif args.command == "search":
-            items = cache_manager.search_cached_items(name_pattern=args.name, sku_pattern=args.sku)
+            # The table only shows four fields; json output keeps whole documents
+            items = list(cache_manager.search_cached_items(
+                name_pattern=args.name, sku_pattern=args.sku, limit=args.limit,
+                projection=None if args.output == "json" else SEARCH_TABLE_PROJECTION
+            ))
             
             if args.output == "json":
-                print(json.dumps(items, indent=2, default=str))
+                _print_json(items)
             else:
                 print(f"\n🔍 Found {len(items)} matching items:")
                 print("=" * 80)
@@ -16,6 +16,12 @@ def test_imports():
         print("  ❌ PIL missing - run: pip3 install Pillow")
         return False
     
+    # Pillow-SIMD releases are tagged .postN; optional, so only informational
+    if '.post' in PIL.__version__:
+        print(f"  ✅ Pillow-SIMD build active ({PIL.__version__})")
+    else:
+        print(f"  ⚠️  Stock Pillow {PIL.__version__} - pillow-simd speeds up conversion (see IMAGE_PROCESSING.md)")
+    
     try:
         import pymongo
         print("  ✅ pymongo installed")
@@ -4,9 +4,10 @@
 from __future__ import annotations
 
 import argparse
-import json
 from pathlib import Path
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 import sys
 
 SCRIPT_DIR = Path(__file__).resolve().parent
@@ -14,8 +15,8 @@ PACKAGE_ROOT = SCRIPT_DIR.parent
 if str(PACKAGE_ROOT) not in sys.path:
     sys.path.insert(0, str(PACKAGE_ROOT))
 
-from square_catalog_toolkit.catalog_ops import FOOD_SOURCE_CATEGORIES  # noqa: E402
-from square_catalog_toolkit.rest_client import SquareRestClient  # noqa: E402
+from square_catalog_toolkit.catalog_ops import FOOD_SOURCE_CATEGORIES, extract_category_ids  # noqa: E402
+from square_catalog_toolkit.jsonio import print_json, write_json  # noqa: E402
 
 
 DEFAULT_REQUIRED_CATEGORIES = [
@@ -63,29 +64,25 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def _category_ids_for_item(item: dict) -> list[str]:
-    out: list[str] = []
-    values = (item.get("item_data") or {}).get("categories") or []
-    for value in values:
-        if isinstance(value, dict):
-            category_id = value.get("id")
-            if category_id:
-                out.append(category_id)
-        elif isinstance(value, str):
-            out.append(value)
-    return out
-
-
 def main() -> int:
     args = parse_args()
     required_categories = DEFAULT_REQUIRED_CATEGORIES + args.require_category
-    excluded_all_site = DEFAULT_EXCLUDED_ALL_SITE_RULES | set(args.exclude_all_site_rule)
+    excluded_all_site = frozenset(DEFAULT_EXCLUDED_ALL_SITE_RULES).union(args.exclude_all_site_rule)
+
+    from square_catalog_toolkit.rest_client import SquareRestClient
 
     client = SquareRestClient()
-    categories = [obj for obj in client.list_catalog_objects_all(types="CATEGORY") if obj.get("type") == "CATEGORY"]
-    items = [obj for obj in client.list_catalog_objects_all(types="ITEM") if obj.get("type") == "ITEM"]
-    channels = client.list_channels().get("channels", [])
-    sites = client.list_sites().get("sites", [])
+    # The fetches are independent, so overlap their round-trips.
+    # One paginated listing covers both types instead of a traversal per type.
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        objects_future = pool.submit(client.list_catalog_objects_all, types="CATEGORY,ITEM")
+        channels_future = pool.submit(client.list_channels)
+        sites_future = pool.submit(client.list_sites)
+        objects = objects_future.result()
+        channels = channels_future.result().get("channels", [])
+        sites = sites_future.result().get("sites", [])
+    categories = [obj for obj in objects if obj.get("type") == "CATEGORY"]
+    items = [obj for obj in objects if obj.get("type") == "ITEM"]
 
     active_site_channels: dict[str, dict] = {}
     active_pos_channels: dict[str, dict] = {}
@@ -99,7 +96,7 @@ def main() -> int:
         elif ref_type == "POINT_OF_SALE":
             active_pos_channels[channel["id"]] = channel
 
-    required_channel_ids = set(active_site_channels) | set(active_pos_channels)
+    required_channel_ids = frozenset(active_site_channels).union(active_pos_channels)
 
     site_by_ref_id = {
         site["id"].replace("site_", ""): site
@@ -117,12 +114,10 @@ def main() -> int:
             "is_published": (site or {}).get("is_published"),
         }
 
-    item_counts = Counter()
-    for item in items:
-        for category_id in _category_ids_for_item(item):
-            item_counts[category_id] += 1
+    item_counts = Counter(chain.from_iterable(extract_category_ids(item) for item in items))
 
     by_name: dict[str, dict] = {}
+    row_by_id: dict[str, dict] = {}
     category_rows: list[dict] = []
     for category in categories:
         category_data = category.get("category_data") or {}
@@ -138,15 +133,15 @@ def main() -> int:
                 if value
             }
         )
-        category_rows.append(
-            {
-                "id": category["id"],
-                "name": name,
-                "items": item_counts.get(category["id"], 0),
-                "online_visibility": category_data.get("online_visibility"),
-                "channel_ids": category_channel_ids,
-            }
-        )
+        row = {
+            "id": category["id"],
+            "name": name,
+            "items": item_counts.get(category["id"], 0),
+            "online_visibility": category_data.get("online_visibility"),
+            "channel_ids": category_channel_ids,
+        }
+        category_rows.append(row)
+        row_by_id[row["id"]] = row
     category_rows.sort(key=lambda row: row["name"].lower())
 
     issues: dict[str, list | dict] = {
@@ -163,19 +158,17 @@ def main() -> int:
             issues["missing_required_categories"].append(name)
 
     for source_name in FOOD_SOURCE_CATEGORIES:
-        category = by_name.get(source_name)
-        if not category:
+        row = row_by_id.get(by_name.get(source_name, {}).get("id"))
+        if not row:
             continue
-        category_data = category.get("category_data") or {}
-        category_id = category.get("id")
-        count = item_counts.get(category_id, 0)
+        count = row["items"]
         if count > 0:
             issues["legacy_food_not_empty"].append(
-                {"name": source_name, "id": category_id, "items": count}
+                {"name": source_name, "id": row["id"], "items": count}
             )
-        if category_data.get("online_visibility", False):
+        if row["online_visibility"]:
             issues["legacy_food_not_hidden"].append(
-                {"name": source_name, "id": category_id, "online_visibility": True}
+                {"name": source_name, "id": row["id"], "online_visibility": True}
             )
 
     for row in category_rows:
@@ -189,7 +182,7 @@ def main() -> int:
             )
         if name in excluded_all_site or name.startswith(DEFAULT_FR_PREFIX):
             continue
-        missing_channels = sorted(set(required_channel_ids) - set(row["channel_ids"]))
+        missing_channels = sorted(required_channel_ids.difference(row["channel_ids"]))
         if missing_channels:
             issues["categories_with_items_missing_required_channels"].append(
                 {
@@ -227,9 +220,9 @@ def main() -> int:
     if args.json_out:
         out_path = Path(args.json_out).expanduser()
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        out_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        write_json(out_path, payload)
 
-    print(json.dumps(payload, indent=2))
+    print_json(payload)
 
     if args.fail_on_issues and issue_count > 0:
         return 1
@@ -3,7 +3,6 @@
 
 from __future__ import annotations
 
-import json
 from pathlib import Path
 import sys
 
@@ -14,16 +13,15 @@ if str(PACKAGE_ROOT) not in sys.path:
 
 from square_catalog_toolkit.compliance import (  # noqa: E402
     docs_trace_for_core_calls,
-    run_rest_version_check,
-    run_sdk_version_check,
+    run_all_checks,
 )
 from square_catalog_toolkit.constants import API_VERSION, DOC_LINKS  # noqa: E402
+from square_catalog_toolkit.jsonio import print_json  # noqa: E402
 
 
 def main() -> int:
-    rest = run_rest_version_check()
-    sdk = run_sdk_version_check()
-    docs = docs_trace_for_core_calls()
+    rest, sdk = run_all_checks()
+    docs = dict(docs_trace_for_core_calls())
 
     ok = bool(rest.get("ok")) and bool(sdk.get("invalid_version_rejected"))
 
@@ -40,7 +38,7 @@ def main() -> int:
         "docs": docs,
         "ok": ok,
     }
-    print(json.dumps(output, indent=2))
+    print_json(output)
     return 0 if ok else 1
 
 
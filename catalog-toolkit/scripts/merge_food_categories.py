@@ -4,7 +4,6 @@
 from __future__ import annotations
 
 import argparse
-import json
 from pathlib import Path
 import sys
 
@@ -14,7 +13,7 @@ if str(PACKAGE_ROOT) not in sys.path:
     sys.path.insert(0, str(PACKAGE_ROOT))
 
 from square_catalog_toolkit.catalog_ops import DEFAULT_FOOD_TARGET, merge_food_categories  # noqa: E402
-from square_catalog_toolkit.rest_client import SquareRestClient  # noqa: E402
+from square_catalog_toolkit.jsonio import print_json  # noqa: E402
 
 
 def parse_args() -> argparse.Namespace:
@@ -38,6 +37,8 @@ def parse_args() -> argparse.Namespace:
 def main() -> int:
     args = parse_args()
     apply_mode = bool(args.apply)
+    from square_catalog_toolkit.rest_client import SquareRestClient
+
     client = SquareRestClient()
 
     result = merge_food_categories(
@@ -46,7 +47,7 @@ def main() -> int:
         apply=apply_mode,
         snapshot_dir=Path(args.snapshot_dir),
     )
-    print(json.dumps(result, indent=2))
+    print_json(result)
     return 0
 
 
@@ -7,21 +7,28 @@ import os
 from pathlib import Path
 import sys
 
-import uvicorn
-
 SCRIPT_DIR = Path(__file__).resolve().parent
 PACKAGE_ROOT = SCRIPT_DIR.parent
 if str(PACKAGE_ROOT) not in sys.path:
     sys.path.insert(0, str(PACKAGE_ROOT))
 
-from square_catalog_toolkit.webhook_monitor import create_app  # noqa: E402
-
 
 def main() -> int:
+    import uvicorn
+
     host = os.environ.get("SQUARE_WEBHOOK_MONITOR_HOST", "0.0.0.0")
     port = int(os.environ.get("SQUARE_WEBHOOK_MONITOR_PORT", "8087"))
-    app = create_app()
-    uvicorn.run(app, host=host, port=port, log_level="info")
+    workers = int(os.environ.get("SQUARE_WEBHOOK_MONITOR_WORKERS", "1"))
+    # Import-string factory so each worker process builds its own app.
+    # loop/http stay "auto": uvloop and httptools are used when installed (uvicorn[standard]).
+    uvicorn.run(
+        "square_catalog_toolkit.webhook_monitor:create_app",
+        factory=True,
+        host=host,
+        port=port,
+        log_level="info",
+        workers=workers,
+    )
     return 0
 
 
@@ -4,8 +4,8 @@
 from __future__ import annotations
 
 import argparse
-import json
 from pathlib import Path
+from typing import TYPE_CHECKING
 import sys
 
 SCRIPT_DIR = Path(__file__).resolve().parent
@@ -14,7 +14,18 @@ if str(PACKAGE_ROOT) not in sys.path:
     sys.path.insert(0, str(PACKAGE_ROOT))
 
 from square_catalog_toolkit.constants import DOC_LINKS  # noqa: E402
-from square_catalog_toolkit.sdk_client import SquareSdkClient  # noqa: E402
+from square_catalog_toolkit.jsonio import print_json  # noqa: E402
+
+if TYPE_CHECKING:
+    from square_catalog_toolkit.sdk_client import SquareSdkClient
+
+LIST_DOCS = {
+    "event_types": DOC_LINKS["list_webhook_event_types"],
+    "subscriptions": DOC_LINKS["list_webhook_subscriptions"],
+}
+CREATE_DOC = DOC_LINKS["create_webhook_subscription"]
+TEST_DOC = DOC_LINKS["test_webhook_subscription"]
+ROTATE_DOC = DOC_LINKS["update_webhook_subscription_signature_key"]
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -50,18 +61,13 @@ def build_parser() -> argparse.ArgumentParser:
 def command_list(client: SquareSdkClient) -> dict:
     event_types = client.list_webhook_event_types()
     subscriptions = client.list_webhook_subscriptions()
-    event_names = []
-    for event in (event_types.event_types or []):
-        if isinstance(event, str):
-            event_names.append(event)
-        else:
-            event_names.append(getattr(event, "name", str(event)))
+    event_names = [
+        event if isinstance(event, str) else getattr(event, "name", str(event))
+        for event in (event_types.event_types or [])
+    ]
     return {
-        "docs": {
-            "event_types": DOC_LINKS["list_webhook_event_types"],
-            "subscriptions": DOC_LINKS["list_webhook_subscriptions"],
-        },
-        "event_types_count": len(event_types.event_types or []),
+        "docs": dict(LIST_DOCS),
+        "event_types_count": len(event_names),
         "event_types": event_names,
         "subscriptions_count": len(subscriptions),
         "subscriptions": [
@@ -86,7 +92,7 @@ def command_create(client: SquareSdkClient, args: argparse.Namespace) -> dict:
     )
     sub = response.subscription
     return {
-        "docs": DOC_LINKS["create_webhook_subscription"],
+        "docs": CREATE_DOC,
         "subscription": {
             "id": sub.id,
             "name": sub.name,
@@ -111,7 +117,7 @@ def command_test(client: SquareSdkClient, args: argparse.Namespace) -> dict:
     else:
         payload = {"raw": str(response)}
     return {
-        "docs": DOC_LINKS["test_webhook_subscription"],
+        "docs": TEST_DOC,
         "status_code": payload.get("status_code"),
         "passes_filter": payload.get("passes_filter"),
         "notification_url": payload.get("notification_url"),
@@ -123,7 +129,7 @@ def command_test(client: SquareSdkClient, args: argparse.Namespace) -> dict:
 def command_rotate(client: SquareSdkClient, args: argparse.Namespace) -> dict:
     response = client.rotate_webhook_signature_key(subscription_id=args.subscription_id)
     return {
-        "docs": DOC_LINKS["update_webhook_subscription_signature_key"],
+        "docs": ROTATE_DOC,
         "status": response.status,
         "signature_key": response.signature_key,
     }
@@ -132,6 +138,9 @@ def command_rotate(client: SquareSdkClient, args: argparse.Namespace) -> dict:
 def main() -> int:
     parser = build_parser()
     args = parser.parse_args()
+
+    from square_catalog_toolkit.sdk_client import SquareSdkClient
+
     client = SquareSdkClient()
 
     if args.command == "list":
@@ -146,7 +155,7 @@ def main() -> int:
         parser.error(f"Unknown command: {args.command}")
         return 2
 
-    print(json.dumps(output, indent=2))
+    print_json(output)
     return 0
 
 
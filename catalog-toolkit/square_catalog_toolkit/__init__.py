@@ -1,7 +1,31 @@
 """Reusable Square catalog toolkit."""
 
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
 from .constants import API_VERSION
-from .rest_client import SquareRestClient
-from .sdk_client import SquareSdkClient
+
+if TYPE_CHECKING:
+    from .rest_client import SquareRestClient
+    from .sdk_client import SquareSdkClient
 
 __all__ = ["API_VERSION", "SquareRestClient", "SquareSdkClient"]
+
+# Clients are resolved on first access so importing a submodule (e.g. constants
+# or catalog_ops from a script) does not load requests and the Square SDK.
+_LAZY_EXPORTS = {
+    "SquareRestClient": ".rest_client",
+    "SquareSdkClient": ".sdk_client",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
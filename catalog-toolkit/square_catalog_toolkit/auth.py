@@ -2,24 +2,38 @@
 
 from __future__ import annotations
 
+from functools import lru_cache
 from pathlib import Path
 import os
 
 
-DEFAULT_ENV_FILE = Path.home() / ".config" / "claude-mcp" / ".env"
+def default_env_file() -> Path:
+    # Resolved per call so a changed HOME (e.g. in tests) is honoured.
+    return Path.home() / ".config" / "claude-mcp" / ".env"
 
 
+# Parsed once per path; the env-file does not change within a process.
+@lru_cache(maxsize=4)
 def _load_env_file(env_file: Path) -> dict[str, str]:
     values: dict[str, str] = {}
-    if not env_file.exists():
+    try:
+        handle = env_file.open("r", encoding="utf-8", errors="ignore")
+    except FileNotFoundError:
         return values
 
-    for raw_line in env_file.read_text(encoding="utf-8", errors="ignore").splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        values[key] = value
+    with handle:
+        for raw_line in handle:
+            line = raw_line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export ") :].strip()
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            values[key] = value
     return values
 
 
@@ -32,7 +46,7 @@ def resolve_square_token(explicit_token: str | None = None, env_file: Path | Non
     if env_token:
         return env_token
 
-    lookup_file = env_file or DEFAULT_ENV_FILE
+    lookup_file = env_file or default_env_file()
     values = _load_env_file(lookup_file)
     token = values.get("SQUARE_ACCESS_TOKEN") or values.get("SQUARE_TOKEN")
     if not token:
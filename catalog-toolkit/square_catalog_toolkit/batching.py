@@ -0,0 +1,33 @@
+"""Packing of catalog objects into Square batch-upsert requests."""
+
+from __future__ import annotations
+
+from itertools import islice
+from typing import Any, Iterable, Iterator
+
+from .constants import MAX_UPSERT_BATCH_OBJECTS, MAX_UPSERT_REQUEST_OBJECTS
+
+
+def pack_upsert_batches(
+    objects: Iterable[dict[str, Any]],
+    batch_size: int = MAX_UPSERT_BATCH_OBJECTS,
+) -> Iterator[list[dict[str, Any]]]:
+    """Yield the `batches` list for each batch-upsert request.
+
+    Objects are split into batches of `batch_size` (each applied atomically by
+    Square), and as many batches as fit the per-request object limit are sent together.
+    """
+    if not 0 < batch_size <= MAX_UPSERT_BATCH_OBJECTS:
+        raise ValueError(f"batch_size must be between 1 and {MAX_UPSERT_BATCH_OBJECTS}")
+    batches_per_request = MAX_UPSERT_REQUEST_OBJECTS // batch_size
+    remaining = iter(objects)
+    while True:
+        batches: list[dict[str, Any]] = []
+        while len(batches) < batches_per_request:
+            chunk = list(islice(remaining, batch_size))
+            if not chunk:
+                break
+            batches.append({"objects": chunk})
+        if not batches:
+            return
+        yield batches
@@ -5,11 +5,14 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
-import json
-import uuid
+from typing import TYPE_CHECKING, Any, Iterator
+import re
 
-from .rest_client import SquareRestClient
+from .idempotency import new_idempotency_key
+from .jsonio import write_json
+
+if TYPE_CHECKING:
+    from .rest_client import SquareRestClient
 
 
 FOOD_SOURCE_CATEGORIES = [
@@ -20,6 +23,9 @@ FOOD_SOURCE_CATEGORIES = [
 ]
 DEFAULT_FOOD_TARGET = "Food & Pantry"
 DEFAULT_CHANNEL_TEMPLATE = "The New Finds"
+MAX_BATCH_RETRIEVE_OBJECTS = 1000
+_TMP_ID_REPLACEMENTS = {" ": "_", "&": "and"}
+_TMP_ID_PATTERN = re.compile("[ &]")
 
 
 @dataclass
@@ -33,21 +39,43 @@ class MergePlan:
     created_category_id: str | None = None
 
 
-def _chunked(items: list[Any], size: int) -> list[list[Any]]:
-    return [items[i : i + size] for i in range(0, len(items), size)]
+CatalogCache = dict[str, list[dict[str, Any]]]
+
+
+def _list_objects(
+    client: SquareRestClient,
+    types: str,
+    cache: CatalogCache | None,
+) -> list[dict[str, Any]]:
+    # One listing per object type for the lifetime of the cache (e.g. one merge run).
+    if cache is None:
+        return client.list_catalog_objects_all(types=types)
+    if types not in cache:
+        cache[types] = client.list_catalog_objects_all(types=types)
+    return cache[types]
+
+
+def _chunked(items: list[Any], size: int) -> Iterator[list[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
 
-def _extract_category_ids(item: dict[str, Any]) -> list[str]:
+def extract_category_ids(item: dict[str, Any]) -> list[str]:
     raw = (item.get("item_data") or {}).get("categories") or []
-    ids: list[str] = []
-    for value in raw:
-        if isinstance(value, dict):
-            category_id = value.get("id")
-            if category_id:
-                ids.append(category_id)
-        elif isinstance(value, str):
-            ids.append(value)
-    return ids
+    return [
+        value["id"] if isinstance(value, dict) else value
+        for value in raw
+        if isinstance(value, str) or (isinstance(value, dict) and value.get("id"))
+    ]
+
+
+# Former private name, kept for existing imports.
+_extract_category_ids = extract_category_ids
+
+
+def _temp_category_id(category_name: str) -> str:
+    # Single regex pass instead of chained str.replace calls.
+    return "#tmp_" + _TMP_ID_PATTERN.sub(lambda m: _TMP_ID_REPLACEMENTS[m.group()], category_name.lower())
 
 
 def _index_categories(categories: list[dict[str, Any]]) -> tuple[dict[str, dict[str, Any]], dict[str, str]]:
@@ -101,30 +129,43 @@ def snapshot_items(
     *,
     item_ids: set[str] | None = None,
     output_dir: Path | None = None,
+    cache: CatalogCache | None = None,
 ) -> Path:
     """Persist a rollback-friendly snapshot of current item categories."""
-    items = client.list_catalog_objects_all(types="ITEM")
-    if item_ids:
-        items = [item for item in items if item.get("id") in item_ids]
-
-    payload = {
-        "captured_at": datetime.now(timezone.utc).isoformat(),
-        "items": [
+    if item_ids and (cache is None or "ITEM" not in cache):
+        # Fetch only the requested items rather than listing the whole catalog.
+        items = []
+        for chunk in _chunked(sorted(item_ids), MAX_BATCH_RETRIEVE_OBJECTS):
+            response = client.batch_retrieve_catalog_objects(
+                {"object_ids": chunk, "include_related_objects": False}
+            )
+            items.extend(response.get("objects", []) or [])
+    else:
+        items = _list_objects(client, "ITEM", cache)
+        if item_ids:
+            items = [item for item in items if item.get("id") in item_ids]
+
+    snapshot_rows: list[dict[str, Any]] = []
+    for item in items:
+        item_data = item.get("item_data") or {}
+        snapshot_rows.append(
             {
                 "id": item.get("id"),
                 "version": item.get("version"),
-                "name": (item.get("item_data") or {}).get("name"),
-                "categories": (item.get("item_data") or {}).get("categories"),
-                "reporting_category": (item.get("item_data") or {}).get("reporting_category"),
+                "name": item_data.get("name"),
+                "categories": item_data.get("categories"),
+                "reporting_category": item_data.get("reporting_category"),
             }
-            for item in items
-        ],
+        )
+    payload = {
+        "captured_at": datetime.now(timezone.utc).isoformat(),
+        "items": snapshot_rows,
     }
 
     target_dir = output_dir or Path.cwd()
     target_dir.mkdir(parents=True, exist_ok=True)
     out_path = target_dir / f"catalog-snapshot-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
-    out_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    write_json(out_path, payload)
     return out_path
 
 
@@ -133,9 +174,10 @@ def plan_merge_categories(
     *,
     source_names: list[str],
     target_name: str,
+    cache: CatalogCache | None = None,
 ) -> MergePlan:
-    categories = client.list_catalog_objects_all(types="CATEGORY")
-    items = client.list_catalog_objects_all(types="ITEM")
+    categories = _list_objects(client, "CATEGORY", cache)
+    items = _list_objects(client, "ITEM", cache)
 
     _, by_name = _index_categories(categories)
 
@@ -151,7 +193,7 @@ def plan_merge_categories(
 
     affected_items: list[dict[str, Any]] = []
     for item in items:
-        current_ids = _extract_category_ids(item)
+        current_ids = extract_category_ids(item)
         if not any(category_id in source_ids for category_id in current_ids):
             continue
 
@@ -162,6 +204,7 @@ def plan_merge_categories(
         affected_items.append(
             {
                 "item_id": item.get("id"),
+                "version": item.get("version"),
                 "name": (item.get("item_data") or {}).get("name"),
                 "old_category_ids": current_ids,
                 "new_category_ids": new_ids,
@@ -182,8 +225,9 @@ def ensure_category(
     *,
     category_name: str,
     channel_template_name: str = DEFAULT_CHANNEL_TEMPLATE,
+    cache: CatalogCache | None = None,
 ) -> str:
-    categories = client.list_catalog_objects_all(types="CATEGORY")
+    categories = _list_objects(client, "CATEGORY", cache)
     by_id, by_name = _index_categories(categories)
     existing_id = by_name.get(category_name)
     if existing_id:
@@ -198,14 +242,14 @@ def ensure_category(
     template_channels = ((by_id[template_id].get("category_data") or {}).get("channels") or [])
 
     payload = {
-        "idempotency_key": str(uuid.uuid4()),
+        "idempotency_key": new_idempotency_key(),
         "sparse_update": True,
         "batches": [
             {
                 "objects": [
                     {
                         "type": "CATEGORY",
-                        "id": f"#tmp_{category_name.lower().replace(' ', '_').replace('&', 'and')}",
+                        "id": _temp_category_id(category_name),
                         "category_data": {
                             "name": category_name,
                             "online_visibility": True,
@@ -220,6 +264,8 @@ def ensure_category(
     mappings = response.get("id_mappings") or []
     if not mappings:
         raise RuntimeError(f"Failed to create category: {category_name}")
+    if cache is not None:
+        cache.pop("CATEGORY", None)
     return mappings[0]["object_id"]
 
 
@@ -229,11 +275,12 @@ def apply_merge_plan(
     *,
     create_target_if_missing: bool = True,
     batch_size: int = 20,
+    cache: CatalogCache | None = None,
 ) -> dict[str, Any]:
     if not plan.target_id:
         if not create_target_if_missing:
             raise RuntimeError(f"Target category '{plan.target_name}' does not exist.")
-        created_id = ensure_category(client, category_name=plan.target_name)
+        created_id = ensure_category(client, category_name=plan.target_name, cache=cache)
         plan.target_id = created_id
         plan.category_created = True
         plan.created_category_id = created_id
@@ -241,7 +288,9 @@ def apply_merge_plan(
     if not plan.target_id:
         raise RuntimeError("Target category ID is missing after ensure-category step.")
 
-    all_items = client.list_catalog_objects_all(types="ITEM")
+    # Listing cached while planning, if still present, holds the exact items the plan saw.
+    planned_items = {item.get("id"): item for item in (cache or {}).get("ITEM", [])}
+    all_items = _list_objects(client, "ITEM", cache)
     by_id = {item["id"]: item for item in all_items if item.get("type") == "ITEM"}
 
     updates: list[dict[str, Any]] = []
@@ -249,16 +298,25 @@ def apply_merge_plan(
         item = by_id.get(affected["item_id"])
         if not item:
             continue
-        current_ids = _extract_category_ids(item)
-        new_ids = [category_id for category_id in current_ids if category_id not in plan.source_ids]
+        if item is planned_items.get(affected["item_id"]) or (
+            affected.get("version") is not None and item.get("version") == affected["version"]
+        ):
+            # Same item the plan was built from: reuse its ids; only a newly created target is missing.
+            current_ids = affected["old_category_ids"]
+            new_ids = affected["new_category_ids"]
+        else:
+            # The item changed since planning, so derive its ids from the fetched copy.
+            current_ids = extract_category_ids(item)
+            new_ids = [category_id for category_id in current_ids if category_id not in plan.source_ids]
         if plan.target_id not in new_ids:
-            new_ids.append(plan.target_id)
+            new_ids = [*new_ids, plan.target_id]
 
         if current_ids == new_ids:
             continue
 
-        item_full = json.loads(json.dumps(item))
-        item_data = item_full.get("item_data") or {}
+        # Only item_data is modified, so shallow copies keep the cached listing intact.
+        item_full = dict(item)
+        item_data = dict(item_full.get("item_data") or {})
         item_data["categories"] = [{"id": category_id} for category_id in new_ids]
         reporting = item_data.get("reporting_category")
         if isinstance(reporting, dict) and reporting.get("id") in plan.source_ids:
@@ -267,17 +325,20 @@ def apply_merge_plan(
         updates.append(item_full)
 
     # Catalog upsert on full ITEM object avoids validation edge-cases for partial ITEM updates.
-    for item_obj in updates:
-        client.upsert_catalog_object(
-            object_payload=item_obj,
-            idempotency_key=str(uuid.uuid4()),
-        )
+    # Each batch of `batch_size` objects is applied atomically by Square.
+    objects_upserted = 0
+    for response in client.upsert_many(updates, batch_size=batch_size):
+        objects_upserted += len(response.get("objects") or [])
+    if updates and cache is not None:
+        # Upserts bump item versions; later reads must refetch.
+        cache.pop("ITEM", None)
 
     return {
         "target_category": plan.target_name,
         "target_category_id": plan.target_id,
         "source_categories": plan.source_name_to_id,
         "items_updated": len(updates),
+        "objects_upserted": objects_upserted,
         "category_created": plan.category_created,
         "created_category_id": plan.created_category_id,
     }
@@ -290,14 +351,21 @@ def merge_food_categories(
     apply: bool = False,
     snapshot_dir: Path | None = None,
 ) -> dict[str, Any]:
+    cache: CatalogCache = {}
     plan = plan_merge_categories(
         client,
         source_names=FOOD_SOURCE_CATEGORIES,
         target_name=target_name,
+        cache=cache,
     )
 
     affected_item_ids = {item["item_id"] for item in plan.affected_items}
-    snapshot_path = snapshot_items(client, item_ids=affected_item_ids, output_dir=snapshot_dir)
+    snapshot_path = snapshot_items(
+        client,
+        item_ids=affected_item_ids,
+        output_dir=snapshot_dir,
+        cache=cache,
+    )
 
     summary: dict[str, Any] = {
         "mode": "apply" if apply else "dry-run",
@@ -311,6 +379,6 @@ def merge_food_categories(
     if not apply:
         return summary
 
-    result = apply_merge_plan(client, plan)
+    result = apply_merge_plan(client, plan, cache=cache)
     summary["result"] = result
     return summary
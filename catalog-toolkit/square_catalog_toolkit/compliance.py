@@ -2,12 +2,35 @@
 
 from __future__ import annotations
 
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Any, Mapping
 
 from .constants import API_VERSION, DOC_LINKS
 from .rest_client import SquareRestClient
 from .sdk_client import SquareSdkClient
 
+# Read-only and resolved once at import; DOC_LINKS does not change at runtime.
+_CORE_DOC_TRACE: Mapping[str, str] = MappingProxyType(
+    {
+        name: DOC_LINKS[name]
+        for name in (
+            "list_catalog",
+            "batch_upsert_catalog_objects",
+            "search_catalog_items",
+            "list_channels",
+            "list_sites",
+            "list_webhook_event_types",
+            "list_webhook_subscriptions",
+            "create_webhook_subscription",
+            "test_webhook_subscription",
+            "update_webhook_subscription_signature_key",
+            "validate_webhook_signatures",
+            "graphql",
+        )
+    }
+)
+
 
 def run_rest_version_check() -> dict[str, Any]:
     client = SquareRestClient(api_version=API_VERSION)
@@ -37,20 +60,13 @@ def run_sdk_version_check() -> dict[str, Any]:
     }
 
 
-def docs_trace_for_core_calls() -> dict[str, str]:
-    return {
-        "list_catalog": DOC_LINKS["list_catalog"],
-        "batch_upsert_catalog_objects": DOC_LINKS["batch_upsert_catalog_objects"],
-        "search_catalog_items": DOC_LINKS["search_catalog_items"],
-        "list_channels": DOC_LINKS["list_channels"],
-        "list_sites": DOC_LINKS["list_sites"],
-        "list_webhook_event_types": DOC_LINKS["list_webhook_event_types"],
-        "list_webhook_subscriptions": DOC_LINKS["list_webhook_subscriptions"],
-        "create_webhook_subscription": DOC_LINKS["create_webhook_subscription"],
-        "test_webhook_subscription": DOC_LINKS["test_webhook_subscription"],
-        "update_webhook_subscription_signature_key": DOC_LINKS[
-            "update_webhook_subscription_signature_key"
-        ],
-        "validate_webhook_signatures": DOC_LINKS["validate_webhook_signatures"],
-        "graphql": DOC_LINKS["graphql"],
-    }
+def run_all_checks() -> tuple[dict[str, Any], dict[str, Any]]:
+    """Run the REST and SDK checks concurrently; returns ``(rest, sdk)``."""
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        rest = pool.submit(run_rest_version_check)
+        sdk = pool.submit(run_sdk_version_check)
+        return rest.result(), sdk.result()
+
+
+def docs_trace_for_core_calls() -> Mapping[str, str]:
+    return _CORE_DOC_TRACE
@@ -3,6 +3,10 @@
 API_VERSION = "2026-01-22"
 BASE_URL = "https://connect.squareup.com"
 
+# Square batch-upsert limits: objects per batch, and objects across one request.
+MAX_UPSERT_BATCH_OBJECTS = 1000
+MAX_UPSERT_REQUEST_OBJECTS = 10000
+
 DOC_LINKS = {
     "versioning_overview": "https://developer.squareup.com/docs/build-basics/versioning-overview",
     "release_2026_01_22": "https://developer.squareup.com/docs/changelog/connect-logs/2026-01-22",
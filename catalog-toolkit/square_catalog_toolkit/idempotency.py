@@ -0,0 +1,11 @@
+"""Idempotency key generation for Square write calls."""
+
+from __future__ import annotations
+
+import os
+
+
+def new_idempotency_key() -> str:
+    # Keys only need to be unique; 16 random bytes as hex (32 chars) fits
+    # Square's 45-char limit and skips UUID object construction/formatting.
+    return os.urandom(16).hex()
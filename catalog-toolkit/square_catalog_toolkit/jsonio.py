@@ -0,0 +1,55 @@
+"""JSON output helpers (orjson when installed, stdlib otherwise)."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional accelerator
+    orjson = None
+
+
+def dumps_bytes(payload: Any) -> bytes:
+    """Return ``payload`` as indented UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+    return json.dumps(payload, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def dumps_compact(payload: Any) -> str:
+    """Return ``payload`` as compact JSON text (no whitespace, non-ASCII kept)."""
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data: bytes | bytearray | str) -> Any:
+    """Parse JSON from bytes or text; raises ``ValueError`` on bad input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json(path: Path, payload: Any) -> None:
+    if orjson is not None:
+        path.write_bytes(dumps_bytes(payload))
+        return
+    # Stream into the file rather than building the full indented string first.
+    with path.open("w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2, ensure_ascii=False)
+
+
+def print_json(payload: Any) -> None:
+    """Write ``payload`` to stdout as indented JSON followed by a newline."""
+    if orjson is not None:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(dumps_bytes(payload))
+        sys.stdout.buffer.write(b"\n")
+        sys.stdout.buffer.flush()
+        return
+    json.dump(payload, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write("\n")
@@ -2,13 +2,29 @@
 
 from __future__ import annotations
 
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator
 import json
+import sys
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .auth import resolve_square_token
-from .constants import API_VERSION, BASE_URL
+from .batching import pack_upsert_batches
+from .constants import API_VERSION, BASE_URL, MAX_UPSERT_BATCH_OBJECTS
+from .idempotency import new_idempotency_key
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - optional streaming parser
+    ijson = None
+
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_CONCURRENT_PAGERS = 8
 
 
 class SquareRestClient:
@@ -21,19 +37,71 @@ class SquareRestClient:
         api_version: str = API_VERSION,
         base_url: str = BASE_URL,
         timeout_seconds: float = 30.0,
+        enable_conditional: bool = False,
     ) -> None:
-        self.token = resolve_square_token(token)
-        self.api_version = api_version
         self.base_url = base_url.rstrip("/")
         self.timeout_seconds = timeout_seconds
+        # ETag -> payload per (url, params) for slow-changing GET endpoints.
+        self.enable_conditional = enable_conditional
+        self._etag_cache: dict[tuple[str, tuple[tuple[str, Any], ...]], tuple[str, Any]] = {}
+        # One pooled session keeps connections alive across paginated calls.
+        # POST retries are safe: Square write calls carry idempotency keys.
+        self._session = requests.Session()
+        self._token = resolve_square_token(token)
+        self._api_version = sys.intern(api_version)
+        self._refresh_headers()
+        retry = Retry(
+            total=RETRY_TOTAL,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self._session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry),
+        )
+
+    def close(self) -> None:
+        self._session.close()
+
+    def __enter__(self) -> SquareRestClient:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @token.setter
+    def token(self, value: str) -> None:
+        self._token = value
+        self._refresh_headers()
+
+    @property
+    def api_version(self) -> str:
+        return self._api_version
+
+    @api_version.setter
+    def api_version(self, value: str) -> None:
+        self._api_version = sys.intern(value)
+        self._refresh_headers()
 
     @property
     def headers(self) -> dict[str, str]:
-        return {
-            "Authorization": f"Bearer {self.token}",
-            "Square-Version": self.api_version,
+        return self._headers
+
+    def _refresh_headers(self) -> None:
+        # Built once per token/version rather than on every request.
+        self._headers = {
+            "Authorization": f"Bearer {self._token}",
+            "Square-Version": self._api_version,
             "Content-Type": "application/json",
         }
+        self._session.headers.update(self._headers)
 
     def request(
         self,
@@ -43,24 +111,45 @@ class SquareRestClient:
         params: dict[str, Any] | None = None,
         body: dict[str, Any] | None = None,
         include_response: bool = False,
+        conditional: bool = False,
+        stream: bool = False,
     ) -> Any:
-        url = f"{self.base_url}{path}"
-        response = requests.request(
-            method=method.upper(),
+        url = self.base_url + path
+        method = method.upper()
+        cache_key = None
+        cached = None
+        headers = None
+        if conditional and self.enable_conditional and method == "GET":
+            cache_key = (url, tuple(sorted((params or {}).items())))
+            cached = self._etag_cache.get(cache_key)
+            if cached:
+                headers = {"If-None-Match": cached[0]}
+        response = self._session.request(
+            method=method,
             url=url,
             params=params,
             json=body,
-            headers=self.headers,
+            headers=headers,
             timeout=self.timeout_seconds,
+            stream=stream,
         )
 
         response.raise_for_status()
         self._assert_response_version(response)
+        if stream:
+            # Caller reads (and closes) the body itself.
+            return response
 
-        try:
-            payload: Any = response.json()
-        except json.JSONDecodeError:
-            payload = response.text
+        if cached and response.status_code == 304:
+            payload: Any = cached[1]
+        else:
+            try:
+                payload = response.json()
+            except json.JSONDecodeError:
+                payload = response.text
+            etag = response.headers.get("ETag")
+            if cache_key and etag:
+                self._etag_cache[cache_key] = (etag, payload)
 
         if include_response:
             return payload, response
@@ -68,10 +157,12 @@ class SquareRestClient:
 
     def _assert_response_version(self, response: requests.Response) -> None:
         returned = response.headers.get("square-version")
-        if returned and returned != self.api_version:
-            raise RuntimeError(
-                f"Square version mismatch: expected {self.api_version}, got {returned}"
-            )
+        # Matching (or absent) header is the common case; skip straight out.
+        if not returned or returned is self._api_version or returned == self._api_version:
+            return
+        raise RuntimeError(
+            f"Square version mismatch: expected {self._api_version}, got {returned}"
+        )
 
     # Catalog
     def list_catalog(
@@ -107,9 +198,58 @@ class SquareRestClient:
                 break
         return objects
 
+    def iter_catalog_objects(self, *, types: str) -> Iterator[dict[str, Any]]:
+        """Yield catalog objects one at a time across all list pages."""
+        cursor: str | None = None
+        while True:
+            if ijson is None:
+                payload = self.list_catalog(types=types, cursor=cursor)
+                yield from payload.get("objects", []) or []
+                cursor = payload.get("cursor")
+            else:
+                params: dict[str, Any] = {"types": types}
+                if cursor:
+                    params["cursor"] = cursor
+                response = self.request("GET", "/v2/catalog/list", params=params, stream=True)
+                with response:
+                    response.raw.decode_content = True
+                    page = _StreamedPage(response.raw)
+                    yield from page.objects()
+                cursor = page.cursor
+            if not cursor:
+                return
+
+    def list_catalog_objects_by_type(self, types: list[str]) -> dict[str, list[dict[str, Any]]]:
+        """Drain one cursor per object type, overlapping the types."""
+        # Pages within a type stay sequential (the cursor demands it).
+        unique_types = list(dict.fromkeys(types))
+        if len(unique_types) <= 1:
+            return {object_type: self.list_catalog_objects_all(types=object_type) for object_type in unique_types}
+        with ThreadPoolExecutor(max_workers=min(len(unique_types), MAX_CONCURRENT_PAGERS)) as pool:
+            futures = {
+                object_type: pool.submit(self.list_catalog_objects_all, types=object_type)
+                for object_type in unique_types
+            }
+            return {object_type: future.result() for object_type, future in futures.items()}
+
+    def batch_retrieve_catalog_objects(self, body: dict[str, Any]) -> dict[str, Any]:
+        return self.request("POST", "/v2/catalog/batch-retrieve", body=body)
+
     def batch_upsert_catalog_objects(self, body: dict[str, Any]) -> dict[str, Any]:
         return self.request("POST", "/v2/catalog/batch-upsert", body=body)
 
+    def upsert_many(
+        self,
+        objects: Iterable[dict[str, Any]],
+        *,
+        batch_size: int = MAX_UPSERT_BATCH_OBJECTS,
+    ) -> Iterator[dict[str, Any]]:
+        """Upsert objects via batch-upsert, yielding one response per request."""
+        for batches in pack_upsert_batches(objects, batch_size):
+            yield self.batch_upsert_catalog_objects(
+                {"idempotency_key": new_idempotency_key(), "batches": batches}
+            )
+
     def upsert_catalog_object(
         self,
         *,
@@ -130,15 +270,15 @@ class SquareRestClient:
 
     # Channels/Sites
     def list_channels(self) -> dict[str, Any]:
-        return self.request("GET", "/v2/channels")
+        return self.request("GET", "/v2/channels", conditional=True)
 
     def list_sites(self) -> dict[str, Any]:
-        return self.request("GET", "/v2/sites")
+        return self.request("GET", "/v2/sites", conditional=True)
 
     # Webhooks
     def list_webhook_event_types(self, *, api_version: str | None = None) -> dict[str, Any]:
         params = {"api_version": api_version} if api_version else None
-        return self.request("GET", "/v2/webhooks/event-types", params=params)
+        return self.request("GET", "/v2/webhooks/event-types", params=params, conditional=True)
 
     def list_webhook_subscriptions(
         self,
@@ -197,3 +337,25 @@ class SquareRestClient:
             f"/v2/webhooks/subscriptions/{subscription_id}/signature-key",
             body=body,
         )
+
+
+class _StreamedPage:
+    """Incrementally parse one list page, yielding objects before the cursor arrives."""
+
+    def __init__(self, raw: Any) -> None:
+        self._raw = raw
+        self.cursor: str | None = None
+
+    def objects(self) -> Iterator[dict[str, Any]]:
+        builder = None
+        for prefix, event, value in ijson.parse(self._raw, use_float=True):
+            if prefix == "cursor":
+                self.cursor = value
+            elif prefix == "objects.item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif builder is not None:
+                builder.event(event, value)
+                if prefix == "objects.item" and event == "end_map":
+                    yield builder.value
+                    builder = None
@@ -2,11 +2,12 @@
 
 from __future__ import annotations
 
-from typing import Any
-import uuid
+from typing import Any, Iterable, Iterator
 
 from .auth import resolve_square_token
-from .constants import API_VERSION
+from .batching import pack_upsert_batches
+from .constants import API_VERSION, MAX_UPSERT_BATCH_OBJECTS
+from .idempotency import new_idempotency_key
 
 from square import Square
 from square.environment import SquareEnvironment
@@ -31,44 +32,56 @@ class SquareSdkClient:
             token=self.token,
             version=self.api_version,
         )
+        # Built once; RequestOptions is a plain mapping the SDK only reads.
+        self._request_options = RequestOptions(additional_headers={"Square-Version": self.api_version})
 
     def request_options(self) -> RequestOptions:
         # Redundant with client.version, intentionally explicit for compliance.
-        return RequestOptions(additional_headers={"Square-Version": self.api_version})
+        return self._request_options
 
     # Catalog
     def list_categories(self) -> list[Any]:
-        pager = self.client.catalog.list(types="CATEGORY", request_options=self.request_options())
+        pager = self.client.catalog.list(types="CATEGORY", request_options=self._request_options)
         return list(pager)
 
     def list_items(self) -> list[Any]:
-        pager = self.client.catalog.list(types="ITEM", request_options=self.request_options())
+        pager = self.client.catalog.list(types="ITEM", request_options=self._request_options)
         return list(pager)
 
     def batch_upsert_catalog_objects(self, *, batches: list[dict[str, Any]]) -> Any:
         return self.client.catalog.batch_upsert(
-            idempotency_key=str(uuid.uuid4()),
+            idempotency_key=new_idempotency_key(),
             batches=batches,
-            request_options=self.request_options(),
+            request_options=self._request_options,
         )
 
+    def upsert_many(
+        self,
+        objects: Iterable[dict[str, Any]],
+        *,
+        batch_size: int = MAX_UPSERT_BATCH_OBJECTS,
+    ) -> Iterator[Any]:
+        """Upsert objects via batch-upsert, yielding one response per request."""
+        for batches in pack_upsert_batches(objects, batch_size):
+            yield self.batch_upsert_catalog_objects(batches=batches)
+
     # Channels/Sites
     def list_channels(self) -> list[Any]:
-        pager = self.client.channels.list(request_options=self.request_options())
+        pager = self.client.channels.list(request_options=self._request_options)
         return list(pager)
 
     def list_sites(self) -> Any:
-        return self.client.sites.list(request_options=self.request_options())
+        return self.client.sites.list(request_options=self._request_options)
 
     # Webhooks
     def list_webhook_event_types(self) -> Any:
         return self.client.webhooks.event_types.list(
             api_version=self.api_version,
-            request_options=self.request_options(),
+            request_options=self._request_options,
         )
 
     def list_webhook_subscriptions(self) -> list[Any]:
-        pager = self.client.webhooks.subscriptions.list(request_options=self.request_options())
+        pager = self.client.webhooks.subscriptions.list(request_options=self._request_options)
         return list(pager)
 
     def create_webhook_subscription(
@@ -86,29 +99,48 @@ class SquareSdkClient:
             "api_version": self.api_version,
         }
         return self.client.webhooks.subscriptions.create(
-            idempotency_key=str(uuid.uuid4()),
+            idempotency_key=new_idempotency_key(),
             subscription=subscription,
-            request_options=self.request_options(),
+            request_options=self._request_options,
         )
 
     def test_webhook_subscription(self, *, subscription_id: str, event_type: str) -> Any:
         return self.client.webhooks.subscriptions.test(
             subscription_id=subscription_id,
             event_type=event_type,
-            request_options=self.request_options(),
+            request_options=self._request_options,
         )
 
     def rotate_webhook_signature_key(self, *, subscription_id: str) -> Any:
         return self.client.webhooks.subscriptions.update_signature_key(
             subscription_id=subscription_id,
-            idempotency_key=str(uuid.uuid4()),
-            request_options=self.request_options(),
+            idempotency_key=new_idempotency_key(),
+            request_options=self._request_options,
         )
 
-    @staticmethod
-    def prove_invalid_version_rejected(token: str | None = None) -> tuple[bool, str]:
+    # Square's version enforcement cannot change mid-process; prove it once per token.
+    _version_proof_cache: dict[str, tuple[bool, str]] = {}
+
+    @classmethod
+    def prove_invalid_version_rejected(
+        cls,
+        token: str | None = None,
+        *,
+        force_refresh: bool = False,
+    ) -> tuple[bool, str]:
         """Return proof that API version header is enforced by Square."""
         resolved = resolve_square_token(token)
+        if not force_refresh and resolved in cls._version_proof_cache:
+            return cls._version_proof_cache[resolved]
+        ok, message, conclusive = cls._request_invalid_version_proof(resolved)
+        # Rate limits and server errors say nothing about version enforcement; retry next time.
+        if conclusive:
+            cls._version_proof_cache[resolved] = (ok, message)
+        return ok, message
+
+    @staticmethod
+    def _request_invalid_version_proof(resolved: str) -> tuple[bool, str, bool]:
+        """Return (ok, message, conclusive); only a 400 rejection or a success is conclusive."""
         invalid = Square(
             environment=SquareEnvironment.PRODUCTION,
             token=resolved,
@@ -116,7 +148,7 @@ class SquareSdkClient:
         )
         try:
             invalid.sites.list()
-            return False, "Unexpected success; invalid version was not rejected."
+            return False, "Unexpected success; invalid version was not rejected.", True
         except ApiError as err:
             body = getattr(err, "body", {}) or {}
             code = ""
@@ -125,4 +157,4 @@ class SquareSdkClient:
                 if errors and isinstance(errors[0], dict):
                     code = errors[0].get("code", "")
             ok = code == "INVALID_SQUARE_VERSION_FORMAT" or err.status_code == 400
-            return ok, f"status={err.status_code} code={code or 'unknown'}"
+            return ok, f"status={err.status_code} code={code or 'unknown'}", err.status_code == 400
@@ -2,21 +2,48 @@
 
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Callable, TypeVar
+import asyncio
 import base64
-import hashlib
+import binascii
 import hmac
-import json
+import logging
 import os
 import sqlite3
+import threading
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 
+from .jsonio import dumps_compact, loads
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional payload compression
+    zstandard = None
+
 SIGNATURE_HEADER = "x-square-hmacsha256-signature"
+EVENT_QUEUE_MAXSIZE = 10000
+EVENT_FLUSH_BATCH_SIZE = 500
+# A failed batch is retried this many times (with backoff), then stored row by row.
+EVENT_FLUSH_RETRIES = 5
+EVENT_FLUSH_BACKOFF_SECONDS = 0.5
+# A webhook that can't be queued this fast gets a 503, so Square redelivers it.
+EVENT_QUEUE_PUT_TIMEOUT_SECONDS = 5.0
+# How long shutdown waits for the flusher to drain before storing the rest itself.
+EVENT_SHUTDOWN_TIMEOUT_SECONDS = 10.0
+
+# (received_at, event_type, merchant_id, event_id, payload_json)
+EventRow = tuple[str, Any, Any, Any, str]
+
+PAYLOAD_ZSTD_LEVEL = 3
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
 
 
 def verify_square_signature(
@@ -34,10 +61,39 @@ def verify_square_signature(
     - notification URL
     - raw request body
     """
-    message = notification_url.encode("utf-8") + request_body
-    digest = hmac.new(signature_key.encode("utf-8"), message, hashlib.sha256).digest()
-    expected = base64.b64encode(digest).decode("utf-8")
-    return hmac.compare_digest(expected, provided_signature)
+    verifier = SquareSignatureVerifier(signature_key=signature_key, notification_url=notification_url)
+    return verifier.verify(request_body, provided_signature)
+
+
+class SquareSignatureVerifier:
+    """Reusable webhook signature check with the key and URL prefix pre-hashed."""
+
+    def __init__(self, *, signature_key: str, notification_url: str) -> None:
+        # Keying HMAC and absorbing the constant URL prefix happens once;
+        # each request only copies this state and hashes its body.
+        # A digest name selects OpenSSL's native HMAC (SHA-NI/ARMv8 SHA2 where
+        # the CPU has them) whenever hashlib is OpenSSL-backed.
+        self._template = hmac.new(
+            signature_key.encode("utf-8"),
+            notification_url.encode("utf-8"),
+            "sha256",
+        )
+
+    def new_mac(self) -> hmac.HMAC:
+        return self._template.copy()
+
+    @staticmethod
+    def matches(mac: hmac.HMAC, provided_signature: str) -> bool:
+        try:
+            provided = base64.b64decode(provided_signature, validate=True)
+        except (binascii.Error, ValueError):
+            return False
+        return hmac.compare_digest(mac.digest(), provided)
+
+    def verify(self, request_body: bytes, provided_signature: str) -> bool:
+        mac = self.new_mac()
+        mac.update(request_body)
+        return self.matches(mac, provided_signature)
 
 
 @dataclass
@@ -60,91 +116,294 @@ class WebhookMonitorConfig:
         return cls(signature_key=signature_key, notification_url=notification_url, db_path=db_path)
 
 
-def _init_db(db_path: Path) -> None:
+def _open_db(db_path: Path) -> sqlite3.Connection:
+    """Open the app's shared connection (WAL, autocommit) and ensure the schema."""
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(db_path) as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS webhook_events (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              received_at TEXT NOT NULL,
-              event_type TEXT,
-              merchant_id TEXT,
-              event_id TEXT,
-              payload_json TEXT NOT NULL
-            );
-            """
-        )
-        conn.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_webhook_events_received_at
-            ON webhook_events(received_at DESC);
-            """
-        )
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    # WAL lets readers proceed during writes and defers fsync to checkpoints.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          received_at TEXT NOT NULL,
+          event_type TEXT,
+          merchant_id TEXT,
+          event_id TEXT,
+          payload_json TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_received_at
+        ON webhook_events(received_at DESC);
+        """
+    )
+    return conn
 
 
-def _store_event(db_path: Path, payload: dict[str, Any]) -> None:
+def _event_row(payload: dict[str, Any]) -> EventRow:
     data = payload.get("data") or {}
     event_type = payload.get("type")
     merchant_id = data.get("merchant_id") or data.get("merchantId")
     event_id = payload.get("event_id") or payload.get("eventId") or data.get("id")
     received_at = datetime.now(timezone.utc).isoformat()
-    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+    raw = dumps_compact(payload)
+    return (received_at, event_type, merchant_id, event_id, raw)
+
+
+def _encode_payloads(rows: list[EventRow]) -> list[tuple[Any, ...]]:
+    # With zstandard installed, payloads are stored as zstd BLOBs in the same
+    # column; older TEXT rows stay readable because SQLite keeps each value's type.
+    if zstandard is None:
+        return rows
+    compressor = zstandard.ZstdCompressor(level=PAYLOAD_ZSTD_LEVEL)
+    return [(*row[:4], compressor.compress(row[4].encode("utf-8"))) for row in rows]
 
-    with sqlite3.connect(db_path) as conn:
-        conn.execute(
+
+def _decode_payload(value: str | bytes) -> Any:
+    if isinstance(value, bytes):
+        if zstandard is None:
+            raise RuntimeError("Stored webhook payload is zstd-compressed; install zstandard to read it")
+        return loads(zstandard.ZstdDecompressor().decompress(value))
+    return loads(value)
+
+
+def _store_events(conn: sqlite3.Connection, rows: list[EventRow]) -> None:
+    rows = _encode_payloads(rows)
+    # One transaction (and one WAL commit) per batch instead of per event.
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(
             """
             INSERT INTO webhook_events (received_at, event_type, merchant_id, event_id, payload_json)
             VALUES (?, ?, ?, ?, ?)
             """,
-            (received_at, event_type, merchant_id, event_id, raw),
+            rows,
         )
-        conn.commit()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
 
-def _get_recent_events(db_path: Path, limit: int) -> list[dict[str, Any]]:
-    with sqlite3.connect(db_path) as conn:
-        rows = conn.execute(
-            """
-            SELECT id, received_at, event_type, merchant_id, event_id, payload_json
-            FROM webhook_events
-            ORDER BY id DESC
-            LIMIT ?
-            """,
+def _locked(lock: threading.Lock, func: Callable[..., T], *args: Any) -> T:
+    with lock:
+        return func(*args)
+
+
+def _store_inflight(conn: sqlite3.Connection, rows: list[EventRow], inflight: list[EventRow]) -> None:
+    _store_events(conn, rows)
+    # Cleared in the committing thread, under db_lock, so shutdown sees exactly what is stored.
+    if len(rows) == len(inflight):
+        inflight.clear()
+    else:
+        for row in rows:
+            inflight.remove(row)
+
+
+async def _flush_events(
+    queue: asyncio.Queue[EventRow | None],
+    conn: sqlite3.Connection,
+    db_lock: threading.Lock,
+    inflight: list[EventRow],
+) -> None:
+    # Runs until it dequeues the None sentinel; `inflight` holds the batch being stored.
+    stopping = False
+    while not stopping:
+        row = await queue.get()
+        if row is None:
+            return
+        batch = [row]
+        while len(batch) < EVENT_FLUSH_BATCH_SIZE:
+            try:
+                row = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+        inflight[:] = batch
+        await _store_with_retry(batch, conn, db_lock, inflight)
+
+
+async def _store_with_retry(
+    batch: list[EventRow],
+    conn: sqlite3.Connection,
+    db_lock: threading.Lock,
+    inflight: list[EventRow],
+) -> None:
+    # These events were already acknowledged, so Square won't redeliver them:
+    # retry transient failures (e.g. a locked database) before giving up.
+    for attempt in range(EVENT_FLUSH_RETRIES):
+        try:
+            # SQLite calls run on a worker thread so the event loop keeps serving requests.
+            await asyncio.to_thread(_locked, db_lock, _store_inflight, conn, batch, inflight)
+            return
+        except Exception:
+            logger.warning(
+                "Storing %d webhook events failed (attempt %d/%d)",
+                len(batch), attempt + 1, EVENT_FLUSH_RETRIES, exc_info=True,
+            )
+            await asyncio.sleep(EVENT_FLUSH_BACKOFF_SECONDS * 2**attempt)
+    # Persistent failure: isolate the rows that can't be stored instead of losing the batch.
+    for row in batch:
+        try:
+            await asyncio.to_thread(_locked, db_lock, _store_inflight, conn, [row], inflight)
+        except Exception:
+            logger.exception("Dropping webhook event %s after %d failed attempts", row[3], EVENT_FLUSH_RETRIES)
+            inflight.remove(row)
+
+
+async def _stop_flusher(queue: asyncio.Queue[EventRow | None], flusher: asyncio.Task[None]) -> None:
+    async def drain() -> None:
+        await queue.put(None)
+        await flusher
+
+    try:
+        await asyncio.wait_for(drain(), EVENT_SHUTDOWN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Webhook event writer did not drain within %gs", EVENT_SHUTDOWN_TIMEOUT_SECONDS)
+    except Exception:
+        logger.exception("Webhook event writer failed")
+    if not flusher.done():
+        flusher.cancel()
+    await asyncio.gather(flusher, return_exceptions=True)
+
+
+_EVENT_COLUMNS = "id, received_at, event_type, merchant_id, event_id"
+
+
+def _event_dict(row: tuple[Any, ...]) -> dict[str, Any]:
+    return {
+        "id": row[0],
+        "received_at": row[1],
+        "event_type": row[2],
+        "merchant_id": row[3],
+        "event_id": row[4],
+    }
+
+
+def _get_recent_events(
+    conn: sqlite3.Connection,
+    limit: int,
+    before_id: int | None = None,
+    include_payload: bool = False,
+) -> list[dict[str, Any]]:
+    # Payloads are only read (and parsed) when asked for; list views need metadata.
+    columns = _EVENT_COLUMNS + ", payload_json" if include_payload else _EVENT_COLUMNS
+    # Keyset paging on the rowid: each page is an index seek, whatever its depth.
+    # (Kept as two query shapes; "? IS NULL OR id < ?" defeats the seek.)
+    if before_id is None:
+        cursor = conn.execute(
+            f"SELECT {columns} FROM webhook_events ORDER BY id DESC LIMIT ?",
             (limit,),
-        ).fetchall()
+        )
+    else:
+        cursor = conn.execute(
+            f"SELECT {columns} FROM webhook_events WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit),
+        )
     events: list[dict[str, Any]] = []
-    for row in rows:
-        event = {
-            "id": row[0],
-            "received_at": row[1],
-            "event_type": row[2],
-            "merchant_id": row[3],
-            "event_id": row[4],
-            "payload": json.loads(row[5]),
-        }
+    for row in cursor:
+        event = _event_dict(row)
+        if include_payload:
+            event["payload"] = _decode_payload(row[5])
         events.append(event)
     return events
 
 
+def _get_event(conn: sqlite3.Connection, event_row_id: int) -> dict[str, Any] | None:
+    row = conn.execute(
+        f"SELECT {_EVENT_COLUMNS}, payload_json FROM webhook_events WHERE id = ?",
+        (event_row_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    event = _event_dict(row)
+    event["payload"] = _decode_payload(row[5])
+    return event
+
+
 def create_app(config: WebhookMonitorConfig | None = None) -> FastAPI:
     cfg = config or WebhookMonitorConfig.from_env()
-    _init_db(cfg.db_path)
+    # One connection per app; the lock keeps statements from interleaving.
+    conn = _open_db(cfg.db_path)
+    db_lock = threading.Lock()
+    verifier = SquareSignatureVerifier(
+        signature_key=cfg.signature_key,
+        notification_url=cfg.notification_url,
+    )
+
+    # Webhooks are acknowledged once queued; a background task writes them in batches.
+    event_queue: asyncio.Queue[EventRow | None] | None = None
+    flusher: asyncio.Task[None] | None = None
+
+    def flusher_alive() -> bool:
+        return flusher is not None and not flusher.done()
 
-    app = FastAPI(title="Square Webhook Monitor", version="0.1.0")
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+        nonlocal event_queue, flusher
+        event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+        inflight: list[EventRow] = []
+        flusher = asyncio.create_task(_flush_events(event_queue, conn, db_lock, inflight))
+        try:
+            yield
+        finally:
+            # Every queued event was already acknowledged: let the flusher finish its
+            # batch and the queue, then store whatever it could not.
+            await _stop_flusher(event_queue, flusher)
+            with db_lock:
+                pending = list(inflight)
+                while not event_queue.empty():
+                    row = event_queue.get_nowait()
+                    if row is not None:
+                        pending.append(row)
+                if pending:
+                    try:
+                        _store_events(conn, pending)
+                    except Exception:
+                        logger.exception("Failed to store %d webhook events at shutdown", len(pending))
+            conn.close()
+
+    app = FastAPI(title="Square Webhook Monitor", version="0.1.0", lifespan=lifespan)
 
     @app.get("/healthz")
-    async def healthz() -> dict[str, Any]:
-        return {
-            "ok": True,
-            "notification_url": cfg.notification_url,
-            "db_path": str(cfg.db_path),
-        }
+    async def healthz() -> JSONResponse:
+        ok = flusher_alive()
+        return JSONResponse(
+            {
+                "ok": ok,
+                "notification_url": cfg.notification_url,
+                "db_path": str(cfg.db_path),
+                "queued_events": event_queue.qsize() if event_queue is not None else 0,
+            },
+            status_code=200 if ok else 503,
+        )
 
     @app.get("/events")
-    async def events(limit: int = 50) -> dict[str, Any]:
+    async def events(
+        limit: int = 50,
+        before_id: int | None = None,
+        include_payload: bool = False,
+    ) -> dict[str, Any]:
         bounded = max(1, min(limit, 500))
-        return {"events": _get_recent_events(cfg.db_path, bounded)}
+        rows = await asyncio.to_thread(
+            _locked, db_lock, _get_recent_events, conn, bounded, before_id, include_payload
+        )
+        return {"events": rows, "next_before_id": rows[-1]["id"] if rows else None}
+
+    @app.get("/events/{event_row_id}")
+    async def event_detail(event_row_id: int) -> dict[str, Any]:
+        event = await asyncio.to_thread(_locked, db_lock, _get_event, conn, event_row_id)
+        if event is None:
+            raise HTTPException(status_code=404, detail="Event not found")
+        return event
 
     @app.post("/webhooks/square")
     async def square_webhook(request: Request) -> JSONResponse:
@@ -152,22 +411,32 @@ def create_app(config: WebhookMonitorConfig | None = None) -> FastAPI:
         if not provided_signature:
             raise HTTPException(status_code=400, detail=f"Missing {SIGNATURE_HEADER} header")
 
-        raw_body = await request.body()
-        is_valid = verify_square_signature(
-            signature_key=cfg.signature_key,
-            notification_url=cfg.notification_url,
-            request_body=raw_body,
-            provided_signature=provided_signature,
-        )
-        if not is_valid:
+        # Hash chunks as they arrive and keep a single body buffer for parsing,
+        # rather than request.body()'s chunk list joined into a second copy.
+        mac = verifier.new_mac()
+        raw_body = bytearray()
+        async for chunk in request.stream():
+            mac.update(chunk)
+            raw_body += chunk
+        if not verifier.matches(mac, provided_signature):
             raise HTTPException(status_code=403, detail="Invalid Square webhook signature")
 
         try:
-            payload = json.loads(raw_body.decode("utf-8"))
-        except json.JSONDecodeError as exc:
+            # The buffer goes straight to the parser; no separate UTF-8 decode.
+            payload = loads(raw_body)
+        except ValueError as exc:
             raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {exc}") from exc
 
-        _store_event(cfg.db_path, payload)
+        # Only acknowledge what will be stored; a 503 makes Square redeliver later.
+        if not flusher_alive():
+            logger.error("Webhook event writer is not running; rejecting webhook")
+            raise HTTPException(status_code=503, detail="Event writer unavailable")
+        try:
+            await asyncio.wait_for(
+                event_queue.put(_event_row(payload)), EVENT_QUEUE_PUT_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError as exc:
+            raise HTTPException(status_code=503, detail="Event queue full") from exc
         return JSONResponse({"ok": True})
 
     return app
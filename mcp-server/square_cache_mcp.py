@@ -5,14 +5,22 @@ Square Cache MCP Server
 Exposes MongoDB-cached Square catalog operations as MCP tools for Claude Desktop.
 """
 
+import atexit
 import json
+import logging
 import sys
 import os
-import io
+import re
+import select
 import subprocess
-import contextlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
 
 def resolve_cache_system_path() -> Optional[str]:
     """Resolve square cache-system directory across current and legacy layouts."""
@@ -51,10 +59,338 @@ else:
 
 try:
     from pymongo import MongoClient
+    from pymongo.errors import OperationFailure, PyMongoError
+    from bson.regex import Regex
 except ImportError as e:
     print(f"Error: Missing pymongo dependency - {e}", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON-RPC encode/decode
+    orjson = None
+
+def _json_default(value: Any) -> str:
+    """Encode datetimes as ISO strings, as orjson does natively."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+else:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=_json_default).encode()
+
+MONGO_URI = 'mongodb://localhost:27017/'
+
+# One pooled client serves every tool call; fail fast when MongoDB is down
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 16,
+    "minPoolSize": 2,
+    "serverSelectionTimeoutMS": 2000,
+    "socketTimeoutMS": 5000,
+    # Identifies these connections in MongoDB logs, currentOp and the profiler
+    "appname": "square-cache-mcp"
+}
+
+# Wire compression (e.g. "zstd,snappy,zlib") only pays off for a remote MongoDB; over
+# loopback it is CPU for nothing, so it is opt-in. pymongo skips (with a warning)
+# compressors whose module (zstandard, python-snappy) is not installed.
+_MONGO_COMPRESSORS = os.environ.get("SQUARE_CACHE_MONGO_COMPRESSORS", "")
+if _MONGO_COMPRESSORS:
+    MONGO_CLIENT_OPTIONS["compressors"] = _MONGO_COMPRESSORS
+
+# Tool calls run concurrently so a slow sync or search does not stall cheap reads
+TOOL_CALL_WORKERS = 4
+
+# Finished sync jobs kept for square_cache_sync_status
+SYNC_JOB_HISTORY = 20
+
+# Most recent cache-manager log lines kept in a sync job's result
+SYNC_LOG_LINES = 1024
+
+# Same collation as the cache manager's search indexes, so prefix queries can use them
+SEARCH_COLLATION = {"locale": "en", "strength": 2}
+
+# Characters that mark a search pattern as a regex rather than a plain prefix
+_REGEX_METACHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Atlas Search index name; when set, plain search patterns use $search autocomplete
+# (token prefixes anywhere in the name/SKU) instead of collation prefix ranges
+ATLAS_SEARCH_INDEX = os.environ.get("SQUARE_CACHE_SEARCH_INDEX", "")
+
+ATLAS_SEARCH_DEFINITION = {
+    "mappings": {
+        "dynamic": False,
+        "fields": {
+            "item_data": {
+                "type": "document",
+                "fields": {
+                    "name": {"type": "autocomplete"},
+                    "variations": {
+                        "type": "document",
+                        "fields": {
+                            "item_variation_data": {
+                                "type": "document",
+                                "fields": {"sku": {"type": "autocomplete"}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Page size for square_cache_search, and the most one call may ask for
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+# Identical searches within this many seconds (e.g. while a query is being refined)
+# reuse the previous page; a finished sync clears them
+SEARCH_CACHE_TTL = 5.0
+SEARCH_CACHE_SIZE = 128
+
+# Tools gated by the read preflight; everything else checks its own operation
+READ_OPERATION = "square_cache_mcp_read"
+READ_TOOLS = frozenset({
+    "square_cache_search",
+    "square_cache_get_item",
+    "square_cache_status",
+    "square_cache_changes",
+    "square_cache_sync_status"
+})
+
+# How long a preflight decision per (operation, runtime, mode) is reused; denials
+# expire sooner so a policy change that re-allows an operation is picked up quickly
+PREFLIGHT_ALLOW_TTL = 30.0
+PREFLIGHT_DENY_TTL = 2.0
+
+# Longest wait for a preflight daemon reply before falling back to a one-shot run
+PREFLIGHT_DAEMON_TIMEOUT = 10.0
+# Consecutive daemon failures (e.g. a script without --daemon) before it is no longer started
+PREFLIGHT_DAEMON_MAX_FAILURES = 3
+
+# Page size for square_cache_changes
+DEFAULT_CHANGES_LIMIT = 20
+MAX_CHANGES_LIMIT = 500
+
+NAME_FIELD = "item_data.name"
+SKU_FIELD = "item_data.variations.item_variation_data.sku"
+CURRENCY_FIELD = "item_data.variations.item_variation_data.price_money.currency"
+
+# Used when the cache has no priced items to sample a currency from
+FALLBACK_CURRENCY = "USD"
+
+# Search-result price, e.g. "$12.50 USD"; bound once rather than parsed per item
+_format_price = "${:.2f} {}".format
+
+# Shapes a catalog item into its search summary on the server, so only the
+# first variation's SKU and price cross the wire
+SEARCH_SUMMARY_STAGE = {
+    "$project": {
+        "_id": 0,
+        "id": 1,
+        "name": "$item_data.name",
+        "updated_at": 1,
+        "variation": {
+            "$let": {
+                "vars": {"first": {"$arrayElemAt": ["$item_data.variations.item_variation_data", 0]}},
+                "in": {
+                    "$cond": [
+                        "$$first",
+                        {"sku": "$$first.sku", "price_money": "$$first.price_money"},
+                        None
+                    ]
+                }
+            }
+        }
+    }
+}
+
+
+# Internal bookkeeping fields never returned by _get_item
+ITEM_DETAIL_PROJECTION = {"_id": 0, "content_hash": 0, "subtree_hashes": 0}
+
+# Fields of the newest sync_log entry that _status reports
+LAST_SYNC_PROJECTION = {"_id": 0, "timestamp": 1, "error": 1, "total_items": 1}
+
+
+# Shapes a change snapshot into its _changes summary on the server: only the
+# keys of `differences` are returned, never before_data/after_data
+CHANGE_SUMMARY_STAGE = {
+    "$project": {
+        "_id": 0,
+        "item_id": 1,
+        "item_name": 1,
+        "change_type": 1,
+        "timestamp": 1,
+        "difference_keys": {
+            "$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$differences", {}]}},
+                "as": "d",
+                "in": "$$d.k"
+            }
+        }
+    }
+}
+
+
+# MCP tool definitions; constant, so tools/list is serialized once below
+TOOLS: List[Dict[str, Any]] = [
+    {
+        "name": "square_cache_search",
+        "description": "Search cached Square catalog items by name or SKU. Returns instant results from MongoDB cache (100x faster than API).",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name_pattern": {
+                    "type": "string",
+                    "description": "Search by item name prefix (case-insensitive; regex if it contains regex characters)"
+                },
+                "sku_pattern": {
+                    "type": "string",
+                    "description": "Search by SKU prefix (case-insensitive; regex if it contains regex characters)"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": f"Maximum number of items to return (default: {DEFAULT_SEARCH_LIMIT}, max: {MAX_SEARCH_LIMIT})"
+                },
+                "after": {
+                    "type": "string",
+                    "description": "Item ID to continue after; pass next_after from the previous page"
+                }
+            }
+        }
+    },
+    {
+        "name": "square_cache_get_item",
+        "description": "Get complete cached item details by Square item ID. Returns full catalog data including variations, pricing, images, categories.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "item_id": {
+                    "type": "string",
+                    "description": "Square catalog item ID"
+                }
+            },
+            "required": ["item_id"]
+        }
+    },
+    {
+        "name": "square_cache_status",
+        "description": "Get cache status including item count, last sync time, MongoDB health. Use to verify cache is operational.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {}
+        }
+    },
+    {
+        "name": "square_cache_changes",
+        "description": "Get recent catalog changes with before/after snapshots. Shows what changed, when, and field-level diffs.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "since": {
+                    "type": "string",
+                    "description": "ISO date string (YYYY-MM-DD) to get changes since"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum number of changes to return (default: 20, max: 500)"
+                }
+            }
+        }
+    },
+    {
+        "name": "square_cache_sync",
+        "description": "Start a full catalog sync from Square API to MongoDB in the background and return its job_id. Detects changes and creates audit snapshots. Requires SQUARE_ACCESS_TOKEN (or legacy SQUARE_TOKEN).",
+        "inputSchema": {
+            "type": "object",
+            "properties": {}
+        }
+    },
+    {
+        "name": "square_cache_sync_status",
+        "description": "Check a background cache sync started by square_cache_sync: running, success (with item and change counts) or failed.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "Job ID returned by square_cache_sync (default: the most recent sync)"
+                }
+            }
+        }
+    }
+]
+
+INITIALIZE_RESULT: Dict[str, Any] = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {
+        "tools": {}
+    },
+    "serverInfo": {
+        "name": "square-cache",
+        "version": "1.0.0"
+    }
+}
+
+# The handshake and tools/list responses are fixed except for the id, so each is
+# stored as the encoded bytes either side of it
+_RESPONSE_PREFIX = b'{"jsonrpc":"2.0","id":'
+_INITIALIZE_SUFFIX = b',"result":' + _dumps(INITIALIZE_RESULT) + b'}'
+_TOOLS_LIST_SUFFIX = b',"result":' + _dumps({"tools": TOOLS}) + b'}'
+
+
+def _precomputed_response(request_id: Any, suffix: bytes) -> bytes:
+    """Splice the request id into a pre-encoded response; only the id is encoded."""
+    return b"".join((_RESPONSE_PREFIX, _dumps(request_id), suffix))
+
+
+@lru_cache(maxsize=256)
+def _case_insensitive_regex(pattern: str) -> Regex:
+    """One Regex per distinct pattern; repeated probes reuse it."""
+    return Regex(pattern, "i")
+
+
+@lru_cache(maxsize=64)
+def _parse_iso(value: str) -> datetime:
+    """Parsed `since` values; clients tend to repeat the same few dates."""
+    return datetime.fromisoformat(value)
+
+
+def _search_condition(pattern: str) -> Any:
+    """Case-insensitive prefix range for plain or "^literal" patterns; regex (full scan) otherwise."""
+    if pattern.startswith("^"):
+        literal = pattern[1:]
+        # "^Bear.*" matches exactly what "^Bear" does
+        if literal.endswith(".*") and not literal.endswith("\\.*"):
+            literal = literal[:-2]
+        if _REGEX_METACHARACTERS.search(literal):
+            return _case_insensitive_regex(pattern)
+        pattern = literal
+    elif _REGEX_METACHARACTERS.search(pattern):
+        return _case_insensitive_regex(pattern)
+    # U+FFFF sorts after every character under the ICU collation
+    return {"$gte": pattern, "$lt": pattern + "\uffff"}
+
+
+class _RingHandler(logging.Handler):
+    """Keeps the last `maxlen` formatted records; older ones are dropped."""
+
+    def __init__(self, maxlen: int):
+        super().__init__(logging.INFO)
+        self.lines: deque = deque(maxlen=maxlen)
+
+    def emit(self, record: logging.LogRecord):
+        self.lines.append(self.format(record))
+
 
 class SquareCacheMCP:
     """MCP Server for Square Cache operations"""
@@ -63,222 +399,374 @@ class SquareCacheMCP:
         self.token = resolve_square_token()
         self.cache_system_path = cache_system_path
         self.import_error = SQUARE_CACHE_IMPORT_ERROR
+        # Syncs run one at a time on their own thread; _sync_lock guards the job table
+        self._sync_lock = threading.Lock()
+        self._sync_executor = ThreadPoolExecutor(max_workers=1)
+        self._sync_jobs: Dict[str, Future] = {}
+        self._active_sync_job: Optional[str] = None
+        # (name_pattern, sku_pattern, limit, after) -> (monotonic time, response)
+        self._search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
         self.preflight_script = os.environ.get(
             "SQUARE_AGENT_PREFLIGHT",
             os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "bin", "agent_preflight.sh")),
         )
+        # Long-lived `agent_preflight.sh --daemon`, started on first use; one request at a time
+        self._preflight_proc: Optional[subprocess.Popen] = None
+        self._preflight_daemon_failures = 0
+        self._preflight_lock = threading.Lock()
+        atexit.register(self._stop_preflight_daemon)
+        # (operation, runtime_id, mode) -> (expires at, error or None)
+        self._preflight_cache: Dict[tuple, tuple] = {}
+        # Uncached read preflights run here, overlapping the tool's query
+        self._preflight_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS)
         
         # Always initialize MongoDB connection for read operations
-        self.client = MongoClient('mongodb://localhost:27017/')
+        self.client = MongoClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
         self.db = self.client['square_cache']
+        self.catalog = self.db['catalog_items']
+        self.snapshots = self.db['change_snapshots']
+        self.sync_log = self.db['sync_log']
+        mongodb_ready = self._warm_connection()
+        # A merchant prices everything in one currency; read it once, not per result
+        self._default_currency = self._sample_currency() if mongodb_ready else FALLBACK_CURRENCY
         
         # Initialize cache manager if token available (for sync operations)
         if self.token and SquareCacheManager:
             self.cache_manager = SquareCacheManager(self.token)
         else:
             self.cache_manager = None
+            if mongodb_ready:
+                self._ensure_indexes()
+        self._atlas_search = bool(ATLAS_SEARCH_INDEX) and mongodb_ready and self._ensure_atlas_search_index()
+        
+        # Tool name -> handler taking the call's arguments
+        self._dispatch: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+            "square_cache_search": self._search,
+            "square_cache_get_item": self._get_item,
+            "square_cache_status": lambda args: self._status(),
+            "square_cache_changes": self._changes,
+            "square_cache_sync": lambda args: self._sync(),
+            "square_cache_sync_status": self._sync_status
+        }
+
+    def _warm_connection(self) -> bool:
+        """Open the first pooled connection now rather than on the first tool call."""
+        try:
+            self.client.admin.command('ping')
+            return True
+        except PyMongoError as e:
+            print(f"Warning: MongoDB not reachable at {MONGO_URI} - {e}", file=sys.stderr)
+            return False
+
+    def _sample_currency(self) -> str:
+        """Currency of the first priced variation in the cache."""
+        try:
+            doc = self.catalog.find_one(
+                {CURRENCY_FIELD: {"$exists": True}}, {"_id": 0, CURRENCY_FIELD: 1}
+            )
+            for variation in doc['item_data']['variations']:
+                currency = ((variation.get('item_variation_data') or {}).get('price_money') or {}).get('currency')
+                if currency:
+                    return currency
+        except (PyMongoError, KeyError, TypeError):
+            pass
+        return FALLBACK_CURRENCY
+
+    def _ensure_indexes(self):
+        """Create the read-path indexes the cache manager would normally own."""
+        try:
+            self.catalog.create_index(NAME_FIELD, collation=SEARCH_COLLATION, name=f"{NAME_FIELD}_ci")
+            self.catalog.create_index(SKU_FIELD, collation=SEARCH_COLLATION, name=f"{SKU_FIELD}_ci")
+            # Serves _changes' newest-first sort (single-field indexes work in both directions)
+            self.snapshots.create_index("timestamp")
+            # _status' latest-sync lookup
+            self.sync_log.create_index("timestamp")
+        except PyMongoError as e:
+            # Queries still work (as scans); _status reports MongoDB health
+            print(f"Warning: could not create indexes - {e}", file=sys.stderr)
+        try:
+            # Same unique index the cache manager creates; _get_item's lookup key
+            self.catalog.create_index("id", unique=True)
+        except PyMongoError as e:
+            print(f"Warning: could not create unique id index - {e}", file=sys.stderr)
+
+    def _ensure_atlas_search_index(self) -> bool:
+        """Create the Atlas Search index if needed; False when the deployment has no search support."""
+        try:
+            self.db.command({
+                "createSearchIndexes": self.catalog.name,
+                "indexes": [{"name": ATLAS_SEARCH_INDEX, "definition": ATLAS_SEARCH_DEFINITION}]
+            })
+        except OperationFailure as e:
+            if e.code != 68:  # IndexAlreadyExists
+                print(f"Warning: Atlas Search unavailable, using prefix search - {e}", file=sys.stderr)
+                return False
+        except PyMongoError as e:
+            print(f"Warning: Atlas Search unavailable, using prefix search - {e}", file=sys.stderr)
+            return False
+        return True
 
     def _run_preflight(self, operation: str) -> Optional[str]:
         """Run runtime preflight policy for an operation. Returns error string when denied."""
+        key = _preflight_key(operation)
+        _, runtime_id, mode = key
+        now = time.monotonic()
+        cached = self._preflight_cache.get(key)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+
+        error = self._check_preflight(operation, runtime_id, mode)
+        self._preflight_cache[key] = (
+            now + (PREFLIGHT_DENY_TTL if error else PREFLIGHT_ALLOW_TTL), error
+        )
+        return error
+
+    def _preflight_cached(self, operation: str) -> bool:
+        """True when _run_preflight would answer from the cache."""
+        cached = self._preflight_cache.get(_preflight_key(operation))
+        return cached is not None and time.monotonic() < cached[0]
+
+    def _check_preflight(self, operation: str, runtime_id: str, mode: str) -> Optional[str]:
+        # Only stat'd on a cache miss; a missing script is a (short-lived) cached denial
         if not os.path.isfile(self.preflight_script):
             return f"Preflight script missing: {self.preflight_script}"
 
-        runtime_id = os.environ.get("SQUARE_RUNTIME_ID", "claude_desktop")
-        mode = os.environ.get("SQUARE_RUNTIME_MODE", "")
-
-        cmd = [self.preflight_script, "--operation", operation, "--runtime", runtime_id, "--quiet"]
-        if mode:
-            cmd.extend(["--mode", mode])
+        reply = self._preflight_daemon_check(operation, runtime_id, mode)
+        if reply is not None:
+            returncode, detail = reply
+        else:
+            cmd = [self.preflight_script, "--operation", operation, "--runtime", runtime_id, "--quiet"]
+            if mode:
+                cmd.extend(["--mode", mode])
 
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode != 0:
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            returncode = proc.returncode
             detail = (proc.stderr or proc.stdout or "").strip()
+        if returncode != 0:
             return (
                 f"Runtime preflight denied for operation '{operation}' "
-                f"(exit {proc.returncode}): {detail}"
+                f"(exit {returncode}): {detail}"
             )
         return None
+
+    def _preflight_daemon_check(self, operation: str, runtime_id: str, mode: str) -> Optional[tuple]:
+        """Ask the preflight daemon; None means use a one-shot run instead."""
+        with self._preflight_lock:
+            if self._preflight_daemon_failures >= PREFLIGHT_DAEMON_MAX_FAILURES:
+                return None
+            try:
+                if self._preflight_proc is None or self._preflight_proc.poll() is not None:
+                    # Unbuffered binary pipes, so select() sees exactly what the daemon wrote
+                    self._preflight_proc = subprocess.Popen(
+                        [self.preflight_script, "--daemon"],
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        bufsize=0
+                    )
+                self._preflight_proc.stdin.write(
+                    _dumps({"operation": operation, "runtime": runtime_id, "mode": mode}) + b"\n"
+                )
+                reply = _loads(_read_line(self._preflight_proc.stdout, PREFLIGHT_DAEMON_TIMEOUT))
+                result = reply["exit"], reply.get("message", "")
+            except (OSError, ValueError, KeyError, TypeError, EOFError) as e:
+                # Covers a hung daemon (TimeoutError), one that exited (EOF) and a preflight
+                # script without --daemon; the next call starts a fresh daemon
+                self._preflight_daemon_failures += 1
+                print(f"Warning: preflight daemon failed, running this check once - {e}", file=sys.stderr)
+                self._stop_preflight_daemon()
+                return None
+            self._preflight_daemon_failures = 0
+            return result
+    
+    def _stop_preflight_daemon(self):
+        proc, self._preflight_proc = self._preflight_proc, None
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
     
     def get_tools(self) -> List[Dict[str, Any]]:
         """Return list of available MCP tools"""
-        return [
-            {
-                "name": "square_cache_search",
-                "description": "Search cached Square catalog items by name or SKU. Returns instant results from MongoDB cache (100x faster than API).",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "name_pattern": {
-                            "type": "string",
-                            "description": "Search by item name (case-insensitive regex)"
-                        },
-                        "sku_pattern": {
-                            "type": "string",
-                            "description": "Search by SKU (case-insensitive regex)"
-                        }
-                    }
-                }
-            },
-            {
-                "name": "square_cache_get_item",
-                "description": "Get complete cached item details by Square item ID. Returns full catalog data including variations, pricing, images, categories.",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "item_id": {
-                            "type": "string",
-                            "description": "Square catalog item ID"
-                        }
-                    },
-                    "required": ["item_id"]
-                }
-            },
-            {
-                "name": "square_cache_status",
-                "description": "Get cache status including item count, last sync time, MongoDB health. Use to verify cache is operational.",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {}
-                }
-            },
-            {
-                "name": "square_cache_changes",
-                "description": "Get recent catalog changes with before/after snapshots. Shows what changed, when, and field-level diffs.",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "since": {
-                            "type": "string",
-                            "description": "ISO date string (YYYY-MM-DD) to get changes since"
-                        },
-                        "limit": {
-                            "type": "integer",
-                            "description": "Maximum number of changes to return (default: 20 if not specified)"
-                        }
-                    }
-                }
-            },
-            {
-                "name": "square_cache_sync",
-                "description": "Trigger full catalog sync from Square API to MongoDB. Detects changes and creates audit snapshots. Requires SQUARE_ACCESS_TOKEN (or legacy SQUARE_TOKEN).",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {}
-                }
-            }
-        ]
+        return TOOLS
     
     def handle_tool_call(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """Handle MCP tool invocation"""
+        handler = self._dispatch.get(tool_name)
+        if handler is None:
+            return {"error": f"Unknown tool: {tool_name}"}
+        if tool_name not in READ_TOOLS:
+            # Sync gates itself before it starts any work
+            try:
+                return handler(arguments)
+            except Exception as e:
+                return {"error": str(e)}
+        
+        if self._preflight_cached(READ_OPERATION):
+            preflight_error = self._run_preflight(READ_OPERATION)
+            if preflight_error:
+                return {"error": preflight_error}
+            try:
+                return handler(arguments)
+            except Exception as e:
+                return {"error": str(e)}
+        
+        # Reads have no side effects, so the query runs while the policy check does;
+        # a denial discards whatever the query returned
+        preflight = self._preflight_executor.submit(self._run_preflight, READ_OPERATION)
         try:
-            if tool_name == "square_cache_search":
-                return self._search(arguments)
-            elif tool_name == "square_cache_get_item":
-                return self._get_item(arguments)
-            elif tool_name == "square_cache_status":
-                return self._status()
-            elif tool_name == "square_cache_changes":
-                return self._changes(arguments)
-            elif tool_name == "square_cache_sync":
-                return self._sync()
-            else:
-                return {"error": f"Unknown tool: {tool_name}"}
+            result = handler(arguments)
         except Exception as e:
-            return {"error": str(e)}
+            result = {"error": str(e)}
+        preflight_error = preflight.result()
+        if preflight_error:
+            return {"error": preflight_error}
+        return result
     
     def _search(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Search cached items"""
-        preflight_error = self._run_preflight("square_cache_mcp_read")
-        if preflight_error:
-            return {"error": preflight_error}
-
-        name_pattern = args.get('name_pattern')
-        sku_pattern = args.get('sku_pattern')
+        # Stripped so "Bears " and "Bears" give the same query shape
+        name_pattern = (args.get('name_pattern') or '').strip()
+        sku_pattern = (args.get('sku_pattern') or '').strip()
         
         if not name_pattern and not sku_pattern:
             return {"error": "Either name_pattern or sku_pattern required"}
         
-        if self.cache_manager:
-            results = self.cache_manager.search_cached_items(
-                name_pattern=name_pattern,
-                sku_pattern=sku_pattern
-            )
-        else:
-            # Direct MongoDB query for read-only access
-            query = {}
-            if name_pattern and sku_pattern:
-                query["$or"] = [
-                    {"item_data.name": {"$regex": name_pattern, "$options": "i"}},
-                    {"item_data.variations.item_variation_data.sku": {"$regex": sku_pattern, "$options": "i"}}
-                ]
-            elif name_pattern:
-                query["item_data.name"] = {"$regex": name_pattern, "$options": "i"}
-            elif sku_pattern:
-                query["item_data.variations.item_variation_data.sku"] = {"$regex": sku_pattern, "$options": "i"}
-            
-            results = list(self.db['catalog_items'].find(query))
+        limit = min(max(int(args.get('limit') or DEFAULT_SEARCH_LIMIT), 1), MAX_SEARCH_LIMIT)
+        after = args.get('after')
+        
+        cache_key = (name_pattern, sku_pattern, limit, after)
+        now = time.monotonic()
+        with self._search_cache_lock:
+            cached = self._search_cache.get(cache_key)
+            if cached is not None and now - cached[0] < SEARCH_CACHE_TTL:
+                return cached[1]
+        
+        results = None
+        if self._atlas_search and not any(
+            _REGEX_METACHARACTERS.search(p) for p in (name_pattern, sku_pattern)
+        ):
+            try:
+                results = self._atlas_search_query(name_pattern, sku_pattern, limit, after)
+            except OperationFailure as e:
+                # e.g. the index was dropped; use prefix search from now on
+                print(f"Warning: Atlas Search query failed, disabling - {e}", file=sys.stderr)
+                self._atlas_search = False
+        if results is None:
+            results = self._prefix_search(name_pattern, sku_pattern, limit, after)
         
         # Format results
         items = []
         for item in results:
-            item.pop('_id', None)  # Remove MongoDB ID
-            item.pop('content_hash', None)  # Internal field
+            variation = item.get('variation')
+            if variation is None:
+                sku = price = 'N/A'
+            else:
+                sku = variation.get('sku', 'N/A')
+                price_money = variation.get('price_money') or {}
+                price = _format_price(
+                    price_money.get('amount', 0) * 0.01,
+                    price_money.get('currency') or self._default_currency
+                )
             items.append({
                 "id": item.get('id'),
-                "name": item.get('item_data', {}).get('name'),
-                "sku": self._get_sku(item),
-                "price": self._get_price(item),
+                "name": item.get('name'),
+                "sku": sku,
+                "price": price,
                 "updated_at": item.get('updated_at')
             })
         
-        return {
+        response = {
             "count": len(items),
             "items": items
         }
+        if len(items) == limit:
+            response["next_after"] = items[-1]["id"]
+        with self._search_cache_lock:
+            self._search_cache[cache_key] = (now, response)
+            self._search_cache.move_to_end(cache_key)
+            if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return response
+    
+    def _prefix_search(self, name_pattern: str, sku_pattern: str, limit: int, after: Optional[str]):
+        # Same conditions as SquareCacheManager.search_cached_items; plain patterns use the collation indexes
+        query = {}
+        if name_pattern and sku_pattern:
+            query["$or"] = [
+                {NAME_FIELD: _search_condition(name_pattern)},
+                {SKU_FIELD: _search_condition(sku_pattern)}
+            ]
+        elif name_pattern:
+            query[NAME_FIELD] = _search_condition(name_pattern)
+        elif sku_pattern:
+            query[SKU_FIELD] = _search_condition(sku_pattern)
+        if after:
+            query["id"] = {"$gt": after}
+        
+        # Keyset paging on the unique item ID; the summary is shaped server-side.
+        # batchSize=limit returns a full page in the first reply instead of 101 + getMore.
+        return self.catalog.aggregate(
+            [{"$match": query}, {"$sort": {"id": 1}}, {"$limit": limit}, SEARCH_SUMMARY_STAGE],
+            collation=SEARCH_COLLATION,
+            batchSize=limit
+        )
+    
+    def _atlas_search_query(self, name_pattern: str, sku_pattern: str, limit: int, after: Optional[str]):
+        clauses = []
+        if name_pattern:
+            clauses.append({"autocomplete": {"query": name_pattern, "path": NAME_FIELD}})
+        if sku_pattern:
+            clauses.append({"autocomplete": {"query": sku_pattern, "path": SKU_FIELD}})
+        pipeline = [{
+            "$search": {
+                "index": ATLAS_SEARCH_INDEX,
+                "compound": {"should": clauses, "minimumShouldMatch": 1}
+            }
+        }]
+        if after:
+            pipeline.append({"$match": {"id": {"$gt": after}}})
+        pipeline += [{"$sort": {"id": 1}}, {"$limit": limit}, SEARCH_SUMMARY_STAGE]
+        return self.catalog.aggregate(pipeline, batchSize=limit)
     
     def _get_item(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Get item by ID"""
-        preflight_error = self._run_preflight("square_cache_mcp_read")
-        if preflight_error:
-            return {"error": preflight_error}
-
         item_id = args.get('item_id')
         if not item_id:
             return {"error": "item_id required"}
         
         if self.cache_manager:
-            item = self.cache_manager.get_cached_item(item_id)
+            item = self.cache_manager.get_cached_item(item_id, projection=ITEM_DETAIL_PROJECTION)
         else:
-            item = self.db['catalog_items'].find_one({"id": item_id})
+            item = self.catalog.find_one({"id": item_id}, ITEM_DETAIL_PROJECTION)
         
         if not item:
             return {"error": f"Item {item_id} not found in cache"}
         
-        item.pop('_id', None)
-        item.pop('content_hash', None)
-        return {"item": self._serialize(item)}
+        # Datetimes are encoded by _dumps; the document is returned as decoded
+        return {"item": item}
     
     def _status(self) -> Dict[str, Any]:
         """Get cache status"""
-        preflight_error = self._run_preflight("square_cache_mcp_read")
-        if preflight_error:
-            return {"error": preflight_error}
-
         try:
-            # Test MongoDB connection
-            self.client.admin.command('ping')
-            mongodb_running = True
-        except Exception:
-            mongodb_running = False
-        
-        items_count = self.db['catalog_items'].count_documents({})
-        changes_count = self.db['change_snapshots'].count_documents({})
-        syncs_count = self.db['sync_log'].count_documents({})
+            # Collection metadata counts; an exact count_documents({}) walks every document.
+            # The first one doubles as the connection check, so no separate ping round-trip.
+            items_count = self.catalog.estimated_document_count()
+        except PyMongoError:
+            return {
+                "mongodb_running": False,
+                "sync_enabled": bool(self.cache_manager),
+                "cache_system_path": self.cache_system_path
+            }
+        changes_count = self.snapshots.estimated_document_count()
+        syncs_count = self.sync_log.estimated_document_count()
         
-        last_sync = self.db['sync_log'].find_one({}, sort=[('timestamp', -1)])
+        last_sync = self.sync_log.find_one(
+            {}, LAST_SYNC_PROJECTION, sort=[('timestamp', -1)]
+        )
         
         return {
-            "mongodb_running": mongodb_running,
+            "mongodb_running": True,
             "items_cached": items_count,
             "changes_tracked": changes_count,
             "sync_operations": syncs_count,
@@ -293,32 +781,28 @@ class SquareCacheMCP:
     
     def _changes(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Get recent changes"""
-        preflight_error = self._run_preflight("square_cache_mcp_read")
-        if preflight_error:
-            return {"error": preflight_error}
-
         since = args.get('since')
-        limit = args.get('limit', 20)
+        # Always bounded; limit 0 used to return the whole snapshot history
+        limit = min(max(int(args.get('limit') or DEFAULT_CHANGES_LIMIT), 1), MAX_CHANGES_LIMIT)
         
         query = {}
         if since:
-            from datetime import datetime
-            since_date = datetime.fromisoformat(since)
+            since_date = _parse_iso(since)
             query['timestamp'] = {'$gte': since_date}
         
-        changes = list(self.db['change_snapshots'].find(query).sort('timestamp', -1).limit(limit))
+        changes = self.snapshots.aggregate(
+            [{'$match': query}, {'$sort': {'timestamp': -1}}, {'$limit': limit}, CHANGE_SUMMARY_STAGE],
+            batchSize=limit
+        )
         
         results = []
         for change in changes:
-            change.pop('_id', None)
-            change.pop('before_data', None)  # Too large for MCP response
-            change.pop('after_data', None)
             results.append({
                 "item_id": change.get('item_id'),
                 "item_name": change.get('item_name'),
                 "change_type": change.get('change_type'),
                 "timestamp": str(change.get('timestamp')),
-                "differences": list((change.get('differences') or {}).keys())
+                "differences": change['difference_keys']
             })
         
         return {
@@ -339,149 +823,216 @@ class SquareCacheMCP:
                 return {"error": f"Sync unavailable: could not import square_cache_manager ({self.import_error})"}
             return {"error": "Sync unavailable: cache manager not initialized"}
         
+        with self._sync_lock:
+            active = self._sync_jobs.get(self._active_sync_job)
+            if active is not None and not active.done():
+                return {"job_id": self._active_sync_job, "status": "running", "already_running": True}
+            
+            job_id = uuid.uuid4().hex
+            self._sync_jobs[job_id] = self._sync_executor.submit(self._run_sync)
+            self._active_sync_job = job_id
+            finished = [jid for jid, future in self._sync_jobs.items() if future.done()]
+            for jid in finished[:max(len(finished) - SYNC_JOB_HISTORY, 0)]:
+                del self._sync_jobs[jid]
+        
+        return {"job_id": job_id, "status": "running"}
+    
+    def _run_sync(self) -> Dict[str, Any]:
+        """Run one cache sync on the sync thread"""
         try:
-            sync_log = io.StringIO()
-            with contextlib.redirect_stdout(sync_log):
+            # Handler on the manager's logger rather than redirect_stdout, which swaps
+            # sys.stdout for every thread; syncs run one at a time so one handler per job
+            sync_log = _RingHandler(SYNC_LOG_LINES)
+            manager_logger = logging.getLogger("square_cache_manager")
+            manager_logger.setLevel(logging.INFO)
+            manager_logger.addHandler(sync_log)
+            try:
                 result = self.cache_manager.sync_from_square()
+            finally:
+                manager_logger.removeHandler(sync_log)
             return {
                 "success": True,
                 "items_processed": result.get('total_items'),
                 "changes_detected": result.get('changes_detected'),
                 "created": result.get('created_count'),
                 "updated": result.get('updated_count'),
-                "sync_log": sync_log.getvalue().strip()
+                "sync_log": "\n".join(sync_log.lines)
             }
         except Exception as e:
             return {"error": str(e)}
+        finally:
+            with self._search_cache_lock:
+                self._search_cache.clear()
     
-    def _get_sku(self, item: Dict) -> str:
-        """Extract SKU from first variation"""
-        variations = item.get('item_data', {}).get('variations', [])
-        if variations:
-            return variations[0].get('item_variation_data', {}).get('sku', 'N/A')
-        return 'N/A'
+    def _sync_status(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Report on a background sync job"""
+        job_id = args.get('job_id') or self._active_sync_job
+        if not job_id:
+            return {"error": "No cache sync has been started"}
+        future = self._sync_jobs.get(job_id)
+        if future is None:
+            return {"error": f"Unknown sync job: {job_id}"}
+        if not future.done():
+            return {"job_id": job_id, "status": "running"}
+        
+        result = future.result()
+        if "error" in result:
+            return {"job_id": job_id, "status": "failed", "message": result["error"]}
+        return {"job_id": job_id, "status": "success", **result}
     
-    def _get_price(self, item: Dict) -> str:
-        """Extract price from first variation"""
-        variations = item.get('item_data', {}).get('variations', [])
-        if variations:
-            price_money = variations[0].get('item_variation_data', {}).get('price_money', {})
-            amount = price_money.get('amount', 0)
-            currency = price_money.get('currency', 'USD')
-            return f"${amount/100:.2f} {currency}"
-        return 'N/A'
-
-    def _serialize(self, obj: Any) -> Any:
-        """Recursively convert datetime objects to ISO strings for JSON serialization"""
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, dict):
-            return {k: self._serialize(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [self._serialize(i) for i in obj]
-        return obj
 
 
+def _read_line(stream, timeout: float) -> bytes:
+    """Read one newline-terminated reply from an unbuffered pipe, within timeout seconds."""
+    deadline = time.monotonic() + timeout
+    fd = stream.fileno()
+    line = bytearray()
+    while not line.endswith(b"\n"):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            raise TimeoutError(f"no reply within {timeout:g}s")
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            raise EOFError("preflight daemon exited")
+        line += chunk
+    return bytes(line)
+
+
+def _preflight_key(operation: str) -> tuple:
+    return (
+        operation,
+        os.environ.get("SQUARE_RUNTIME_ID", "claude_desktop"),
+        os.environ.get("SQUARE_RUNTIME_MODE", "")
+    )
+
+
+def _error_response(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+
+def _tool_response(request_id: Any, tool_result: Dict[str, Any]) -> Dict[str, Any]:
+    # Check if tool returned error
+    if "error" in tool_result:
+        return _error_response(request_id, -32000, tool_result["error"])
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "result": {
+            "content": [{
+                "type": "text",
+                "text": _dumps(tool_result).decode()
+            }]
+        }
+    }
+
 
 def main():
     """MCP server main loop with proper JSON-RPC 2.0 protocol"""
     server = SquareCacheMCP()
     
-    # MCP stdio protocol (JSON-RPC 2.0)
-    for line in sys.stdin:
+    # Binary stdout skips the text-encoding layer
+    out = sys.stdout.buffer
+    write_lock = threading.Lock()
+    pending = bytearray()
+    flushing = False
+    
+    def send(payload: bytes):
+        # Group commit: responses that finish while another thread is writing are
+        # appended to `pending` and go out with that thread's next write + flush
+        nonlocal flushing
+        with write_lock:
+            pending.extend(payload)
+            pending.extend(b"\n")
+            if flushing:
+                return
+            flushing = True
+        while True:
+            with write_lock:
+                if not pending:
+                    flushing = False
+                    return
+                chunk = bytes(pending)
+                pending.clear()
+            try:
+                out.write(chunk)
+                out.flush()
+            except BaseException:
+                with write_lock:
+                    flushing = False
+                raise
+    
+    def encode(response: Any) -> bytes:
+        return response if isinstance(response, bytes) else _dumps(response)
+    
+    def call_tool(request: Dict[str, Any]) -> Dict[str, Any]:
+        request_id = request.get('id')
         try:
-            request = json.loads(line)
-            request_id = request.get('id')
-            method = request.get('method')
-            
-            if method == 'initialize':
-                # MCP handshake
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "protocolVersion": "2024-11-05",
-                        "capabilities": {
-                            "tools": {}
-                        },
-                        "serverInfo": {
-                            "name": "square-cache",
-                            "version": "1.0.0"
-                        }
-                    }
-                }
-            elif method == 'tools/list':
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "tools": server.get_tools()
-                    }
-                }
-            elif method == 'tools/call':
-                tool_name = request['params']['name']
-                arguments = request['params'].get('arguments', {})
-                tool_result = server.handle_tool_call(tool_name, arguments)
-                
-                # Check if tool returned error
-                if "error" in tool_result:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "error": {
-                            "code": -32000,
-                            "message": tool_result["error"]
-                        }
-                    }
-                else:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "result": {
-                            "content": [{
-                                "type": "text",
-                                "text": json.dumps(tool_result, indent=2)
-                            }]
-                        }
-                    }
-            elif method == 'notifications/initialized':
-                # Client notification - no response needed
-                continue
-            else:
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "error": {
-                        "code": -32601,
-                        "message": f"Method not found: {method}"
-                    }
-                }
-            
-            print(json.dumps(response))
-            sys.stdout.flush()
-            
-        except json.JSONDecodeError as e:
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {
-                    "code": -32700,
-                    "message": f"Parse error: {str(e)}"
-                }
-            }
-            print(json.dumps(error_response))
-            sys.stdout.flush()
+            params = request['params']
+            return _tool_response(request_id, server.handle_tool_call(params['name'], params.get('arguments', {})))
         except Exception as e:
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": request.get('id') if 'request' in locals() else None,
-                "error": {
-                    "code": -32603,
-                    "message": f"Internal error: {str(e)}"
-                }
-            }
-            print(json.dumps(error_response))
-            sys.stdout.flush()
+            return _error_response(request_id, -32603, f"Internal error: {str(e)}")
+    
+    def respond(request: Any) -> Any:
+        """Response for one request object; None for notifications"""
+        if not isinstance(request, dict):
+            return _error_response(None, -32600, "Invalid Request")
+        request_id = request.get('id')
+        method = request.get('method')
+        
+        if method == 'initialize':
+            # MCP handshake
+            return _precomputed_response(request_id, _INITIALIZE_SUFFIX)
+        elif method == 'tools/list':
+            return _precomputed_response(request_id, _TOOLS_LIST_SUFFIX)
+        elif method == 'tools/call':
+            return call_tool(request)
+        elif method == 'notifications/initialized':
+            # Client notification - no response needed
+            return None
+        return _error_response(request_id, -32601, f"Method not found: {method}")
+    
+    def send_tool_call(request: Dict[str, Any]):
+        send(encode(call_tool(request)))
+    
+    def send_batch(batch: List[Any]):
+        responses = [encode(response) for response in map(respond, batch) if response is not None]
+        if responses:
+            send(b"[" + b",".join(responses) + b"]")
+    
+    # MCP stdio protocol (JSON-RPC 2.0); tools/call responses may arrive out of order, matched by id
+    with ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS) as pool:
+        # Raw bytes lines go straight to the JSON parser, with no text decoding
+        for line in sys.stdin.buffer:
+            if line.isspace():
+                # Keep-alive / trailing blank lines are not requests; don't answer with parse errors
+                continue
+            try:
+                request = _loads(line)
+                if isinstance(request, list):
+                    # JSON-RPC batch: answered with a single array
+                    if request:
+                        pool.submit(send_batch, request)
+                    else:
+                        send(encode(_error_response(None, -32600, "Invalid Request: empty batch")))
+                elif isinstance(request, dict) and request.get('method') == 'tools/call':
+                    pool.submit(send_tool_call, request)
+                else:
+                    response = respond(request)
+                    if response is not None:
+                        send(encode(response))
+                
+            except json.JSONDecodeError as e:
+                send(encode(_error_response(None, -32700, f"Parse error: {str(e)}")))
+            except Exception as e:
+                request_id = request.get('id') if isinstance(locals().get('request'), dict) else None
+                send(encode(_error_response(request_id, -32603, f"Internal error: {str(e)}")))
 
 
 if __name__ == '__main__':
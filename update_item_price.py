@@ -14,6 +14,56 @@ import sys
 import json
 import requests
 import argparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = "https://connect.squareup.com/v2"
+
+# One keep-alive session for every call, so repeated updates share a TLS connection.
+# POST retries are safe: the upsert carries an idempotency key.
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "Square-Version": "2024-09-18",
+    "Content-Type": "application/json"
+})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False  # hand the last response to raise_for_status
+    )
+))
+
+# Square limits: object_ids per BatchRetrieve, objects per upsert batch, objects per BatchUpsert request
+MAX_RETRIEVE_OBJECTS = 1000
+MAX_BATCH_OBJECTS = 1000
+MAX_REQUEST_OBJECTS = 10000
+
+# Server-maintained fields echoed by RetrieveCatalogObject; upserts don't need them back
+_READ_ONLY_FIELDS = ("updated_at", "created_at", "is_deleted")
+
+
+def build_price_update(variation: dict, new_price_cents: int) -> dict:
+    """
+    Build the upsert object that sets a variation's price.
+    
+    Square's upsert replaces the whole variation, so every writable field is kept;
+    only the read-only fields are dropped and price_money is replaced.
+    """
+    updated_object = {k: v for k, v in variation.items() if k not in _READ_ONLY_FIELDS}
+    variation_data = dict(updated_object.get('item_variation_data') or {})
+    variation_data['pricing_type'] = 'FIXED_PRICING'  # price_money is ignored otherwise
+    variation_data['price_money'] = {
+        'amount': new_price_cents,
+        'currency': 'USD'
+    }
+    updated_object['item_variation_data'] = variation_data
+    return updated_object
 
 
 def update_item_variation_price(square_token: str, variation_id: str, new_price_cents: int):
@@ -25,18 +75,13 @@ def update_item_variation_price(square_token: str, variation_id: str, new_price_
         variation_id: The variation ID to update
         new_price_cents: New price in cents (e.g., 450 for $4.50)
     """
-    base_url = "https://connect.squareup.com/v2"
-    headers = {
-        "Square-Version": "2024-09-18",
-        "Authorization": f"Bearer {square_token}",
-        "Content-Type": "application/json"
-    }
+    headers = {"Authorization": f"Bearer {square_token}"}
     
     print(f"🔍 Fetching current variation data for {variation_id}...")
     
     # First, retrieve the current variation
-    retrieve_url = f"{base_url}/catalog/object/{variation_id}"
-    response = requests.get(retrieve_url, headers=headers)
+    retrieve_url = f"{BASE_URL}/catalog/object/{variation_id}"
+    response = _SESSION.get(retrieve_url, headers=headers)
     response.raise_for_status()
     
     current_object = response.json()['object']
@@ -46,17 +91,10 @@ def update_item_variation_price(square_token: str, variation_id: str, new_price_
     print(f"📊 New price: ${new_price_cents/100:.2f}")
     
     # Update the variation
-    updated_object = current_object.copy()
-    if 'item_variation_data' not in updated_object:
-        updated_object['item_variation_data'] = {}
-    
-    updated_object['item_variation_data']['price_money'] = {
-        'amount': new_price_cents,
-        'currency': 'USD'
-    }
+    updated_object = build_price_update(current_object, new_price_cents)
     
     # Use UpsertCatalogObject to update
-    upsert_url = f"{base_url}/catalog/object"
+    upsert_url = f"{BASE_URL}/catalog/object"
     upsert_data = {
         "idempotency_key": f"update-price-{variation_id}-{new_price_cents}",
         "object": updated_object
@@ -64,7 +102,7 @@ def update_item_variation_price(square_token: str, variation_id: str, new_price_
     
     print(f"⏳ Updating price via Square API...")
     
-    response = requests.post(upsert_url, headers=headers, json=upsert_data)
+    response = _SESSION.post(upsert_url, headers=headers, json=upsert_data)
     response.raise_for_status()
     
     result = response.json()
@@ -78,26 +116,110 @@ def update_item_variation_price(square_token: str, variation_id: str, new_price_
     return result
 
 
+def batch_update_item_variation_prices(square_token: str, updates: list):
+    """
+    Update many variation prices with one BatchRetrieve and one BatchUpsert call.
+    
+    Args:
+        square_token: Square API access token
+        updates: List of (variation_id, new_price_cents) tuples
+    
+    Returns:
+        List of BatchUpsertCatalogObjects responses (one per 10,000 variations)
+    """
+    headers = {"Authorization": f"Bearer {square_token}"}
+    prices = dict(updates)
+    variation_ids = list(prices)
+    
+    print(f"🔍 Fetching current data for {len(variation_ids)} variations...")
+    
+    variations = []
+    for start in range(0, len(variation_ids), MAX_RETRIEVE_OBJECTS):
+        response = _SESSION.post(
+            f"{BASE_URL}/catalog/batch-retrieve",
+            headers=headers,
+            json={"object_ids": variation_ids[start:start + MAX_RETRIEVE_OBJECTS]}
+        )
+        response.raise_for_status()
+        variations.extend(response.json().get('objects', []))
+    
+    missing = set(variation_ids) - {v['id'] for v in variations}
+    if missing:
+        raise ValueError(f"Variations not found: {', '.join(sorted(missing))}")
+    
+    updated_objects = [build_price_update(v, prices[v['id']]) for v in variations]
+    
+    print(f"⏳ Updating {len(updated_objects)} prices via Square API...")
+    
+    results = []
+    for start in range(0, len(updated_objects), MAX_REQUEST_OBJECTS):
+        request_objects = updated_objects[start:start + MAX_REQUEST_OBJECTS]
+        # Fresh key per request: Square ties a key to its exact body, and the
+        # object versions change after every run. The session's retries resend
+        # this same body and key, so a retried POST is still applied once.
+        response = _SESSION.post(
+            f"{BASE_URL}/catalog/batch-upsert",
+            headers=headers,
+            json={
+                "idempotency_key": os.urandom(16).hex(),
+                "batches": [
+                    {"objects": request_objects[i:i + MAX_BATCH_OBJECTS]}
+                    for i in range(0, len(request_objects), MAX_BATCH_OBJECTS)
+                ]
+            }
+        )
+        response.raise_for_status()
+        results.append(response.json())
+    
+    for variation_id, price_cents in prices.items():
+        print(f"✅ {variation_id}: ${price_cents/100:.2f}")
+    print(f"📦 Updated {len(prices)} variations in {len(results)} batch request(s)")
+    
+    return results
+
+
+def load_batch_file(path: str) -> list:
+    """Read [{"variation_id": ..., "price": <dollars>}, ...] into (variation_id, cents) tuples."""
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    return [(entry['variation_id'], to_cents(entry['price'])) for entry in entries]
+
+
+def to_cents(dollars: float) -> int:
+    # round(), not int(): 4.35 * 100 is 434.999...
+    return int(round(dollars * 100))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Update Square item variation price to remove strikethrough"
     )
     parser.add_argument(
         "variation_id",
+        nargs="?",
         help="The variation ID to update (e.g., 4FV7QCHVQ262VEPB4UPFQQR4)"
     )
     parser.add_argument(
         "--price",
         type=float,
-        required=True,
         help="New price in dollars (e.g., 4.50)"
     )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help='JSON file of [{"variation_id": ..., "price": 4.50}, ...] to update in one batch call'
+    )
     parser.add_argument(
         "--token",
         help="Square access token (or set SQUARE_TOKEN env var)"
     )
     
     args = parser.parse_args()
+    if args.batch:
+        if args.variation_id or args.price is not None:
+            parser.error("--batch cannot be combined with variation_id/--price")
+    elif not args.variation_id or args.price is None:
+        parser.error("variation_id and --price are required (or use --batch FILE)")
     
     # Get Square token
     square_token = args.token or os.environ.get('SQUARE_ACCESS_TOKEN') or os.environ.get('SQUARE_TOKEN')
@@ -105,10 +227,13 @@ def main():
         print("❌ Error: Square token required. Set SQUARE_ACCESS_TOKEN env var or use --token")
         sys.exit(1)
     
-    # Convert dollars to cents
-    price_cents = int(args.price * 100)
-    
     try:
+        if args.batch:
+            batch_update_item_variation_prices(square_token, load_batch_file(args.batch))
+            return
+        
+        # Convert dollars to cents
+        price_cents = to_cents(args.price)
         result = update_item_variation_price(square_token, args.variation_id, price_cents)
         
         if args.price < 5.00: